@@ -0,0 +1,183 @@
+"""
+Benchmarks every transform at several data sizes.
+
+    python benchmarks/bench.py run --sizes 1e3,1e5 --output results.json
+    python benchmarks/bench.py compare baseline.json results.json
+
+run records the best time of several repetitions and the peak memory
+allocated by each case. compare flags cases which got slower or used more
+memory than the threshold allows, and exits with a non-zero status if
+any did.
+"""
+
+import argparse
+import datetime
+import gc
+import importlib.util
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from cases import CASES
+from datasets import make_dataset
+
+DEFAULT_SIZES = "1e3,1e4,1e5,1e6,1e7"
+
+# Differences smaller than this are treated as noise
+MIN_SECONDS = 0.001
+MIN_BYTES = 1024 * 1024
+
+
+def measure(setup, ds, repeat):
+    times = []
+    for _ in range(repeat):
+        fn = setup(ds.copy())
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    # Measure memory separately, since tracing slows everything down
+    fn = setup(ds.copy())
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": min(times),
+        "mean_seconds": sum(times) / len(times),
+        "peak_bytes": peak,
+    }
+
+
+def run(args):
+    sizes = [int(float(s)) for s in args.sizes.split(",")]
+    names = args.cases.split(",") if args.cases else list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        sys.exit(f"Unknown cases: {', '.join(unknown)}")
+
+    missing = {
+        name
+        for name in names
+        if any(importlib.util.find_spec(m) is None for m in CASES[name][2])
+    }
+    for name in sorted(missing):
+        print(f"Skipping {name}: requires {', '.join(CASES[name][2])}")
+
+    results = []
+    for rows in sizes:
+        ds, _ = make_dataset(rows)
+        for name in names:
+            setup, max_rows, _ = CASES[name]
+            if rows > max_rows or name in missing:
+                continue
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                result = measure(setup, ds, args.repeat)
+
+            result.update({"case": name, "rows": rows})
+            results.append(result)
+            print(
+                f"{name:32} {rows:>10,} rows  {result['seconds'] * 1000:10.1f}ms"
+                f"  {result['peak_bytes'] / 2 ** 20:8.1f}MB",
+                flush=True,
+            )
+
+    output = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    before = {(r["case"], r["rows"]): r for r in baseline["results"]}
+    regressions = 0
+
+    for r in current["results"]:
+        old = before.get((r["case"], r["rows"]))
+        if old is None:
+            continue
+
+        flags = []
+        if (
+            r["seconds"] > old["seconds"] * (1 + args.threshold)
+            and r["seconds"] - old["seconds"] > MIN_SECONDS
+        ):
+            flags.append("time")
+        if (
+            r["peak_bytes"] > old["peak_bytes"] * (1 + args.threshold)
+            and r["peak_bytes"] - old["peak_bytes"] > MIN_BYTES
+        ):
+            flags.append("memory")
+        regressions += bool(flags)
+
+        change = r["seconds"] / old["seconds"] - 1 if old["seconds"] else 0
+        print(
+            f"{r['case']:32} {r['rows']:>10,} rows"
+            f"  {old['seconds'] * 1000:10.1f}ms -> {r['seconds'] * 1000:10.1f}ms"
+            f" ({change:+.0%})"
+            f"  {old['peak_bytes'] / 2 ** 20:8.1f}MB -> {r['peak_bytes'] / 2 ** 20:8.1f}MB"
+            + (f"  REGRESSION ({', '.join(flags)})" if flags else "")
+        )
+
+    print(f"{regressions} regression(s)")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("run", help="run the benchmarks")
+    p.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated row counts")
+    p.add_argument("--cases", help="comma separated case names (default: all)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--output", default="bench_results.json")
+    p.set_defaults(fn=run)
+
+    p = commands.add_parser("compare", help="compare two result files")
+    p.add_argument("baseline")
+    p.add_argument("current")
+    p.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed slowdown, e.g. 0.2 = 20%%"
+    )
+    p.set_defaults(fn=compare)
+
+    p = commands.add_parser("list", help="list the benchmark cases")
+    p.set_defaults(fn=lambda args: print("\n".join(CASES)))
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
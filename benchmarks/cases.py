@@ -0,0 +1,359 @@
+"""
+Benchmark cases. Each case is a setup function which receives the
+benchmark dataset and returns a function running the transform once.
+Setup runs before every repetition and isn't timed, so transforms which
+modify their input always start from fresh data.
+"""
+
+import numpy as np
+import pandas as pd
+
+import xforms
+from xforms import dtypes, incremental
+from xforms.cache import ResultCache, caching
+
+from datasets import COLUMN_TYPES, make_customers
+
+CASES = {}
+
+
+def case(max_rows=10 ** 7, requires=()):
+    """
+    Registers a benchmark case, skipped for datasets over max_rows and
+    when any of the optional modules it requires isn't installed
+    """
+
+    def register(fn):
+        CASES[fn.__name__] = (fn, max_rows, requires)
+        return fn
+
+    return register
+
+
+FILTERS = [
+    {"column": "price", "operator": ">", "operand": "50"},
+    {"column": "category", "operator": "=", "operand": "Games"},
+    {"column": "region", "operator": "IN", "operand": ["North", "East"]},
+]
+
+
+@case()
+def filter_all(ds):
+    return lambda: xforms.filter(ds, FILTERS)
+
+
+@case()
+def filter_any(ds):
+    return lambda: xforms.filter(ds, FILTERS, match_type="any")
+
+
+@case()
+def sort(ds):
+    columns = [
+        {"col_name": "category", "direction": 1},
+        {"col_name": "price", "direction": -1},
+    ]
+    return lambda: xforms.sort(ds, columns)
+
+
+@case()
+def group_by_low_cardinality(ds):
+    data = ds[["category", "region", "price", "quantity"]].copy()
+    return lambda: xforms.group_by(data, {"price": "SUM", "quantity": "AVG"})
+
+
+@case()
+def group_by_high_cardinality(ds):
+    data = ds[["customer", "price", "category"]].copy()
+    return lambda: xforms.group_by(
+        data, {"price": "MAX", "category": "COUNT_DISTINCT"}
+    )
+
+
+@case()
+def group_by_median(ds):
+    data = ds[["category", "price"]].copy()
+    return lambda: xforms.group_by(data, {"price": "MEDIAN"})
+
+
+@case(max_rows=10 ** 6)
+def group_by_group_concat(ds):
+    data = ds[["category", "customer"]].dropna()
+    return lambda: xforms.group_by(data, {"customer": "GROUP_CONCAT"})
+
+
+@case()
+def pivot(ds):
+    data = ds[["category", "region", "price"]].copy()
+    return lambda: xforms.pivot(data, ["SUM"])
+
+
+@case()
+def pivot_multiple_aggregations(ds):
+    data = ds[["customer", "region", "price", "quantity"]].copy()
+    return lambda: xforms.pivot(data, ["SUM", "MAX"])
+
+
+def _join_inputs(ds):
+    return [ds[["customer", "price", "quantity"]].copy(), make_customers(ds)]
+
+
+@case()
+def left_join(ds):
+    datasets = _join_inputs(ds)
+    return lambda: xforms.left_join(datasets, 1)
+
+
+@case()
+def inner_join(ds):
+    datasets = _join_inputs(ds)
+    return lambda: xforms.inner_join(datasets, 1)
+
+
+@case()
+def full_outer_join(ds):
+    datasets = _join_inputs(ds)
+    return lambda: xforms.full_outer_join(datasets, 1)
+
+
+@case(max_rows=10 ** 6)
+def sqlite_new(ds):
+    data = ds[["quantity", "price", "discount", "category"]].copy()
+    query = "CASE WHEN price > 50 THEN price * quantity ELSE 0 END"
+    return lambda: xforms.sqlite_new(data, "total", query)
+
+
+@case(max_rows=10 ** 6)
+def sqlite_new_sqlite_engine(ds):
+    data = ds[["quantity", "price", "discount", "category"]].copy()
+    query = "CASE WHEN price > 50 THEN price * quantity ELSE 0 END"
+    return lambda: xforms.sqlite_new(data, "total", query, engine="sqlite")
+
+
+def _order_total(row):
+    return row["price"] * row["quantity"]
+
+
+@case(max_rows=10 ** 5)
+def custom_new(ds):
+    return lambda: xforms.custom_new(ds, "total", _order_total)
+
+
+@case()
+def custom_new_batch(ds):
+    return lambda: xforms.custom_new(ds, "total", _order_total, mode="batch")
+
+
+@case()
+def case_statement_new(ds):
+    conditions = [
+        {"value": "cheap", "value_type": "LITERAL", "operand": 10, "operator": "<"},
+        {"value": "normal", "value_type": "LITERAL", "operand": 100, "operator": "<"},
+        {"value": "unknown", "value_type": "LITERAL", "operand": "null", "operator": "IS"},
+    ]
+    return lambda: xforms.case_statement_new(
+        ds, "price_band", "price", conditions, "expensive"
+    )
+
+
+@case()
+def case_statement_new_many_branches(ds):
+    conditions = [
+        {"value": f"under {i * 5}", "value_type": "LITERAL", "operand": i * 5, "operator": "<"}
+        for i in range(1, 40)
+    ]
+    conditions += [
+        {"value": c, "value_type": "LITERAL", "operand": f"%{c[1:3]}%", "operator": "LIKE"}
+        for c in ("Books", "Games", "Garden")
+    ]
+    return lambda: xforms.case_statement_new(
+        ds, "price_band", "price", conditions, "expensive"
+    )
+
+
+@case()
+def histogram_buckets(ds):
+    return lambda: xforms.histogram_buckets(
+        ds, "price", "COUNT", "custom_buckets", [0, 10, 50, 100, 200]
+    )
+
+
+@case()
+def datediff_new(ds):
+    return lambda: xforms.datediff_new(ds, "days", "date", "shipped", "day")
+
+
+@case()
+def datediff_new_month(ds):
+    return lambda: xforms.datediff_new(ds, "months", "date", "shipped", "month")
+
+
+@case(max_rows=10 ** 6)
+def datediff_new_strings(ds):
+    data = ds[["date", "shipped"]].astype(str)
+    return lambda: xforms.datediff_new(data, "months", "date", "shipped", "month")
+
+
+@case()
+def substr_new(ds):
+    return lambda: xforms.substr_new(ds, "prefix", "customer", 1, 4)
+
+
+@case()
+def markdown_link_new(ds):
+    return lambda: xforms.markdown_link_new(ds, "link", "customer", "category")
+
+
+@case()
+def combine_columns_concatenate(ds):
+    return lambda: xforms.combine_columns(ds, "label", ["category", "region"], "-")
+
+
+@case()
+def combine_columns_add(ds):
+    return lambda: xforms.combine_columns(
+        ds, "total", ["price", "discount", "quantity"], operator="add"
+    )
+
+
+@case()
+def arithmetic_new(ds):
+    def run():
+        rc = xforms.multiply_new(ds, "gross", "price", "quantity")
+        rc = xforms.subtract_new(rc, "net", "gross", "discount")
+        return xforms.divide_new(rc, "unit", "net", "quantity")
+
+    return run
+
+
+@case()
+def running_total_new(ds):
+    return lambda: xforms.running_total_new(ds, "running", "price")
+
+
+@case()
+def ratio_of_total_new(ds):
+    return lambda: xforms.ratio_of_total_new(ds, "share", "price")
+
+
+@case()
+def zero_fill(ds):
+    daily = xforms.group_by(ds[["date", "price"]], {"price": "SUM"})
+    # leave gaps in the calendar to be filled
+    daily = daily.iloc[::2].reset_index(drop=True)
+    return lambda: xforms.zero_fill(daily, {"date": "date", "SUM(price)": "real"})
+
+
+@case()
+def zero_fill_by_region(ds):
+    daily = xforms.group_by(ds[["date", "region", "price"]], {"price": "SUM"})
+    daily = daily.iloc[::2].reset_index(drop=True)
+    return lambda: xforms.zero_fill(
+        daily, {"date": "date", "region": "text", "SUM(price)": "real"}, keys=["region"]
+    )
+
+
+@case(max_rows=10 ** 5)
+def transpose(ds):
+    data = ds[["customer", "price", "quantity"]].drop_duplicates("customer")
+    return lambda: xforms.transpose(data)
+
+
+@case(requires=("plotly",))
+def table_page(ds):
+    import plotly.graph_objects as go
+
+    # build the figure without opening a browser
+    go.Figure.show = lambda self: None
+    return lambda: xforms.table(ds, page=10, page_size=1000)
+
+
+@case()
+def format_column(ds):
+    return lambda: xforms.format_column(ds["price"], "currency")
+
+
+@case()
+def downsample_minmax(ds):
+    data = ds[["date", "price", "quantity"]].sort_values("date")
+    return lambda: xforms.downsample_rows(data, method="minmax")
+
+
+@case()
+def downsample_lttb(ds):
+    data = ds[["date", "price", "quantity"]].sort_values("date")
+    return lambda: xforms.downsample_rows(data, method="lttb")
+
+
+@case()
+def bin_points(ds):
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(
+        {
+            "customer": ds["customer"],
+            "lat": rng.uniform(-60, 70, len(ds)),
+            "lon": rng.uniform(-180, 180, len(ds)),
+            "price": ds["price"],
+        }
+    )
+    return lambda: xforms.bin_points(data, 2, cells="hex")
+
+
+@case()
+def optimize_dtypes(ds):
+    return lambda: dtypes.optimize(ds, COLUMN_TYPES)
+
+
+@case()
+def group_by_optimized(ds):
+    data = dtypes.optimize(ds[["category", "region", "price", "quantity"]], COLUMN_TYPES)
+    return lambda: xforms.group_by(data, {"price": "SUM", "quantity": "AVG"})
+
+
+@case()
+def filter_optimized(ds):
+    data = dtypes.optimize(ds, COLUMN_TYPES)
+    return lambda: xforms.filter(data, FILTERS)
+
+
+@case()
+def result_cache_hit(ds):
+    data = dtypes.optimize(ds[["category", "region", "price"]], COLUMN_TYPES)
+    results = ResultCache()
+
+    def run():
+        with caching(results):
+            return xforms.group_by(data, {"price": "SUM"})
+
+    # fill the cache, so the timed runs are hits
+    run()
+    return run
+
+
+def _history_and_delta(ds):
+    # the last 1% of rows are the ones appended since the last refresh
+    split = len(ds) - max(len(ds) // 100, 1)
+    return ds.iloc[:split], ds.iloc[split:].copy()
+
+
+@case()
+def incremental_group_by(ds):
+    history, delta = _history_and_delta(ds[["category", "region", "price", "quantity"]])
+    groups = incremental.GroupBy({"price": "SUM", "quantity": "AVG"}).add(history)
+    return lambda: groups.add(delta).result()
+
+
+@case()
+def incremental_running_total(ds):
+    history, delta = _history_and_delta(ds)
+    totals = incremental.RunningTotal("running", "price")
+    totals.add(history.copy())
+    return lambda: totals.add(delta)
+
+
+@case()
+def incremental_histogram(ds):
+    history, delta = _history_and_delta(ds)
+    buckets = incremental.Histogram("price", "COUNT", "custom_buckets", [0, 10, 50, 100, 200])
+    buckets.add(history)
+    return lambda: buckets.add(delta).result()
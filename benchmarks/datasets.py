@@ -0,0 +1,75 @@
+"""
+Synthetic datasets for the benchmarks. They are generated from a fixed
+seed so runs on different machines use identical data.
+"""
+
+import numpy as np
+import pandas as pd
+
+CATEGORIES = ["Books", "Games", "Garden", "Home", "Kitchen", "Music", "Sports", "Toys"]
+REGIONS = ["North", "South", "East", "West"]
+
+COLUMN_TYPES = {
+    "date": "date",
+    "shipped": "date",
+    "category": "text",
+    "region": "text",
+    "customer": "text",
+    "quantity": "integer",
+    "price": "currency",
+    "discount": "percentage",
+}
+
+
+def make_dataset(rows, seed=0):
+    """
+    Returns a dataset of orders with low cardinality (category, region)
+    and high cardinality (customer) keys, dates and nulls, along with its
+    column_types
+    """
+    rng = np.random.default_rng(seed)
+    rows = int(rows)
+
+    date = pd.Timestamp("2020-01-01") + pd.to_timedelta(
+        rng.integers(0, 3 * 365, rows), unit="D"
+    )
+    shipped = date + pd.to_timedelta(rng.integers(0, 60, rows), unit="D")
+
+    category = rng.choice(np.array(CATEGORIES, dtype=object), rows)
+    category[rng.random(rows) < 0.02] = None
+
+    customers = max(rows // 10, 1)
+    customer = pd.Series(rng.integers(0, customers, rows)).map("c{:07d}".format)
+
+    price = rng.gamma(2.0, 30.0, rows).round(2)
+    price[rng.random(rows) < 0.05] = np.nan
+
+    ds = pd.DataFrame(
+        {
+            "date": date,
+            "shipped": shipped,
+            "category": category,
+            "region": rng.choice(np.array(REGIONS, dtype=object), rows),
+            "customer": customer.values,
+            "quantity": rng.integers(1, 20, rows),
+            "price": price,
+            "discount": rng.random(rows).round(2) * 0.3,
+        }
+    )
+    return ds, dict(COLUMN_TYPES)
+
+
+def make_customers(ds, seed=1):
+    """
+    Returns a table with one row per customer in ds, sorted by customer,
+    for join benchmarks
+    """
+    rng = np.random.default_rng(seed)
+    customers = np.sort(ds["customer"].unique())
+    return pd.DataFrame(
+        {
+            "customer": customers,
+            "segment": rng.choice(np.array(["Consumer", "Corporate"], dtype=object), len(customers)),
+            "credit": rng.integers(0, 10000, len(customers)),
+        }
+    )
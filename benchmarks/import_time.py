@@ -0,0 +1,66 @@
+"""
+Measures how long `import xforms` takes in a fresh interpreter, and checks
+that it doesn't pull in any plotting or notebook libraries.
+
+    python benchmarks/import_time.py [--runs 5] [--max-seconds 1.0]
+
+Exits with a non-zero status if the import is too slow or a heavy module
+was imported.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = [
+    "matplotlib",
+    "plotly",
+    "IPython",
+]
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import xforms
+elapsed = time.perf_counter() - start
+heavy = sorted({m.split(".")[0] for m in sys.modules} & set(%r))
+print(json.dumps({"seconds": elapsed, "heavy": heavy}))
+""" % (
+    HEAVY_MODULES,
+)
+
+
+def measure():
+    out = subprocess.run(
+        [sys.executable, "-c", SCRIPT], check=True, capture_output=True, text=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    seconds = statistics.median(r["seconds"] for r in results)
+    heavy = sorted({m for r in results for m in r["heavy"]})
+
+    print(f"import xforms: {seconds * 1000:.1f}ms (median of {args.runs})")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: importing xforms loaded {', '.join(heavy)}")
+        failed = True
+    if seconds > args.max_seconds:
+        print(f"FAIL: import took longer than {args.max_seconds}s")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+import xforms
+from xforms import cache, profiling
+
+
+def test_mixed_types_are_fingerprinted_apart():
+    a = pd.DataFrame({"k": pd.Series([1, "x"], dtype=object)})
+    b = pd.DataFrame({"k": pd.Series(["1", "x"], dtype=object)})
+    filters = [{"column": "k", "operator": "=", "operand": 1, "operand_type": "LITERAL"}]
+
+    with cache.caching():
+        assert len(xforms.filter(a, filters)) == 1
+        assert len(xforms.filter(b, filters)) == 0
+
+    assert len(xforms.filter(a, filters, cache=True)) == 1
+    assert len(xforms.filter(b, filters, cache=True)) == 0
+
+
+def test_refuses_to_combine_with_profiling():
+    group_by = xforms.group_by
+    with profiling.profile():
+        with pytest.raises(Exception, match="profiling"):
+            cache.enable(cache.ResultCache())
+    with cache.caching():
+        with pytest.raises(Exception, match="caching"):
+            profiling.enable(profiling.MemorySink())
+    assert xforms.group_by is group_by
+
+
+def test_in_place_on_hit():
+    with cache.caching() as results:
+        for _ in range(2):
+            ds = pd.DataFrame({"a": [1, 2], "b": [3, 4]})
+            rc = xforms.add_new(ds, "c", "a", "b")
+            assert rc is ds
+            assert list(ds["c"]) == [4, 6]
+        assert results.stats()["hits"] == 1
@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+
+import xforms
+
+
+def _case(ds, operand):
+    conditions = [
+        {"operator": "=", "operand": operand, "value": "hit", "value_type": "LITERAL"}
+    ]
+    return xforms.case_statement_new(ds.copy(), "r", "k", conditions, "miss")["r"]
+
+
+def test_operand_types_compile_separately():
+    ds = pd.DataFrame({"k": [5]})
+    assert list(_case(ds, "5")) == ["miss"]
+    assert list(_case(ds, np.int64(5))) == ["hit"]
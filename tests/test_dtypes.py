@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import xforms
+from xforms import dtypes
+
+
+@pytest.fixture
+def ds():
+    return pd.DataFrame(
+        {
+            "k": ["a", "b", "a", "b", "a", "b"] * 3,
+            "t": ["x", "y", "z", "x", "y", "z"] * 3,
+            "v": [1, 2, 3, 4, 5, 6] * 3,
+            "w": [10, 20, 30, 40, 50, 60] * 3,
+        }
+    )
+
+
+def test_optimize_narrows(ds):
+    small = dtypes.optimize(ds)
+    assert isinstance(small["k"].dtype, pd.CategoricalDtype)
+    assert isinstance(small["t"].dtype, pd.CategoricalDtype)
+    assert small["v"].dtype.itemsize == 1
+
+
+TRANSFORMS = {
+    "group_by_min": lambda d: xforms.group_by(d[["k", "t"]], {"t": "MIN"}),
+    "group_by_concat": lambda d: xforms.group_by(
+        d[["k", "t"]], {"t": "GROUP_CONCAT"}
+    ),
+    "pivot": lambda d: xforms.pivot(d[["k", "t", "v"]], ["SUM"]),
+    "pivot_multiple": lambda d: xforms.pivot(d[["k", "t", "v", "w"]], ["SUM", "MIN"]),
+    "custom_row": lambda d: xforms.custom_new(
+        d.copy(), "c", lambda r: r["v"] * r["w"] * 100
+    ),
+    "custom_batch": lambda d: xforms.custom_new(
+        d.copy(), "c", lambda c: c["v"] * c["w"] * 100, mode="batch"
+    ),
+}
+
+
+@pytest.mark.parametrize("name", TRANSFORMS)
+def test_optimized_results_match(ds, name):
+    transform = TRANSFORMS[name]
+    expected = transform(ds)
+    actual = transform(dtypes.optimize(ds))
+    pd.testing.assert_frame_equal(
+        actual, expected, check_dtype=False, check_categorical=False
+    )
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+import xforms
+
+
+def _equals(operand):
+    return [{"column": "k", "operator": "=", "operand": operand, "operand_type": "LITERAL"}]
+
+
+def test_operand_types_compile_separately():
+    ds = pd.DataFrame({"k": [5, 6]})
+    assert len(xforms.filter(ds, _equals("5"))) == 0
+    assert len(xforms.filter(ds, _equals(np.int64(5)))) == 1
+    assert len(xforms.filter(ds, _equals(5))) == 1
+
+
+def test_multiple_conditions():
+    ds = pd.DataFrame({"a": [1, 2, 3, 4], "b": ["x", "y", "x", "y"]})
+    filters = [
+        {"column": "a", "operator": ">", "operand": "1"},
+        {"column": "b", "operator": "=", "operand": "x"},
+    ]
+    assert list(xforms.filter(ds, filters)["a"]) == [3]
+    assert list(xforms.filter(ds, filters, match_type="any")["a"]) == [1, 2, 3, 4]
@@ -0,0 +1,45 @@
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+
+import xforms
+
+
+def test_format_column_repeated_values():
+    values = pd.Series([1234.5, None, 1234.5, 2.0] * 10)
+    rc = xforms.format_column(values, "currency")
+    assert list(rc[:4]) == ["$1,234.50", "", "$1,234.50", "$2.00"]
+
+
+def test_format_column_distinct_values():
+    values = pd.Series(np.arange(1000) + 0.5)
+    values[3] = np.nan
+    rc = xforms.format_column(values, "real", precision=1)
+    assert list(rc[:5]) == ["0.5", "1.5", "2.5", "", "4.5"]
+
+
+def test_format_column_unformattable_values():
+    values = pd.Series([1234.5, None, "x", [1]], dtype=object)
+    assert list(xforms.format_column(values, "real")) == ["1,234.50", "", "x", "[1]"]
+
+
+def test_wide_table_precision_per_column(monkeypatch):
+    shown = []
+    display = types.ModuleType("IPython.display")
+    display.HTML = lambda html: html
+    display.display = shown.append
+    monkeypatch.setitem(sys.modules, "IPython", types.ModuleType("IPython"))
+    monkeypatch.setitem(sys.modules, "IPython.display", display)
+
+    ds = pd.DataFrame({"a": [1.23456], "b": [1.23456], "c": [1.23456]})
+    xforms.wide_table(
+        ds,
+        column_types={"a": "real", "b": "real", "c": "real"},
+        column_precision={"a": 1, "b": 3, "c": 0},
+    )
+    (html,) = shown
+    assert "<td>1.2</td>" in html
+    assert "<td>1.235</td>" in html
+    assert "<td>1</td>" in html
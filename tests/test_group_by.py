@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import xforms
+
+METHODS = {
+    "MIN": "min",
+    "MAX": "max",
+    "SUM": "sum",
+    "AVG": "mean",
+    "MEDIAN": "median",
+    "COUNT": "count",
+    "COUNT_DISTINCT": "nunique",
+}
+
+VALUES = {
+    "int64": [1, 5, 2, 3, 4],
+    "float64": [1.0, np.nan, 2.0, 3.0, 4.0],
+    "bool": [True, False, False, True, True],
+    "Int64": pd.array([1, 5, 2, None, 4], dtype="Int64"),
+    "Int64_no_nulls": pd.array([1, 5, 2, 3, 4], dtype="Int64"),
+    "Float64": pd.array([1.5, None, 2.0, 3.0, 4.0], dtype="Float64"),
+    "boolean": pd.array([True, False, None, True, True], dtype="boolean"),
+}
+
+
+def _numbers(values):
+    return [None if pd.isna(v) else float(v) for v in values]
+
+
+@pytest.mark.parametrize("dtype", VALUES)
+@pytest.mark.parametrize("action", METHODS)
+def test_matches_pandas(dtype, action):
+    ds = pd.DataFrame({"k": ["a", "a", "b", "b", "b"], "v": VALUES[dtype]})
+    expected = ds.groupby("k")["v"].agg(METHODS[action])
+    rc = xforms.group_by(ds, {"v": action})
+    assert list(rc["k"]) == list(expected.index)
+    assert _numbers(rc.iloc[:, 1]) == _numbers(expected)
+
+
+@pytest.mark.parametrize("aggregation", ["SUM", "MIN", "MAX", "AVG"])
+def test_bin_points_nullable_values(aggregation):
+    ds = pd.DataFrame(
+        {
+            "name": ["a", "b", "c"],
+            "lat": [1.1, 1.2, 5.0],
+            "lon": [2.1, 2.2, 7.0],
+            "v": pd.array([1, None, 3], dtype="Int64"),
+        }
+    )
+    rc = xforms.bin_points(ds, aggregation=aggregation)
+    assert _numbers(rc["v"]) == [1.0, 3.0]
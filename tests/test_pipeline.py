@@ -0,0 +1,56 @@
+import pandas as pd
+
+import xforms
+from xforms.pipeline import Pipeline
+
+
+def _ds():
+    return pd.DataFrame({"a": [1, 2, 3], "b": [10, 20, 30], "s": ["x", "y", "z"]})
+
+
+def test_arguments_by_name():
+    filters = [{"column": "a", "operator": ">", "operand": 1, "operand_type": "LITERAL"}]
+    conditions = [
+        {"operator": "=", "operand": "y", "value": "Y", "value_type": "LITERAL"}
+    ]
+    by_position = (
+        Pipeline()
+        .add_new("c", "a", "b")
+        .filter(filters)
+        .case_statement_new("x", "s", conditions, "other")
+        .run(_ds())
+    )
+    by_name = (
+        Pipeline()
+        .add_new(new_col="c", addend_1="a", addend_2="b")
+        .filter(filters=filters)
+        .case_statement_new("x", source="s", conditions=conditions, default="other")
+        .run(_ds())
+    )
+    pd.testing.assert_frame_equal(by_name, by_position)
+    assert list(by_name["c"]) == [22, 33]
+    assert list(by_name["x"]) == ["Y", "other"]
+
+
+def test_streamed_arguments_by_name():
+    chunks = [_ds(), _ds()]
+    rc = pd.concat(
+        Pipeline().running_total_new(new_col="t", source="a").stream(chunks),
+        ignore_index=True,
+    )
+    assert list(rc["t"]) == [1, 3, 6, 7, 9, 12]
+
+
+def test_filter_stays_after_batch_custom():
+    filters = [{"column": "a", "operator": ">", "operand": 1, "operand_type": "LITERAL"}]
+    ds = pd.DataFrame({"a": [1, 2, 3, 4]})
+
+    def centered(d):
+        return d["a"] - d["a"].mean()
+
+    eager = xforms.custom_new(ds.copy(), "c", centered, mode="batch")
+    eager = xforms.filter(eager, filters)
+    pipeline = Pipeline().custom_new("c", centered, mode="batch").filter(filters)
+    assert pipeline.explain()[0].startswith("custom_new")
+    rc = pipeline.run(ds.copy())
+    assert list(rc["c"]) == list(eager["c"]) == [-0.5, 0.5, 1.5]
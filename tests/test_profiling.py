@@ -0,0 +1,13 @@
+import pandas as pd
+
+import xforms
+from xforms import profiling
+
+
+def test_join_input_shape():
+    a = pd.DataFrame({"k": [1, 2], "x": [1, 2]})
+    b = pd.DataFrame({"k": [1, 3], "y": [1, 2]})
+    with profiling.profile() as sink:
+        xforms._join("inner", [a, b], 1)
+    (record,) = [r for r in sink.records if r["step"] == "_join"]
+    assert (record["rows_in"], record["columns_in"]) == (4, 4)
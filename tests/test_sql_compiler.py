@@ -0,0 +1,131 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import xforms
+from xforms import sql_compiler
+
+
+@pytest.fixture
+def ds():
+    return pd.DataFrame(
+        {
+            "a": [7, 1, -7, 4, 9],
+            "b": [2, 0, 2, 3, 5],
+            "x": [1.5, -2.25, 0.0, None, 10.0],
+            "flag": [True, False, True, True, False],
+            "s": ["apple", "Banana", None, "cherry pie", "a_b"],
+            "d": [
+                "2020-01-31",
+                "2021-02-28 10:00:00",
+                "not a date",
+                "2020-01-01T10:00",
+                "2020-01-01 10:00:00.5",
+            ],
+            "big": [2**62, 2**53 + 1, -(2**60), 3, 2**63 - 1],
+        }
+    )
+
+
+EXPRESSIONS = [
+    "a + b",
+    "a - b",
+    "a * b",
+    "a / b",
+    "a % b",
+    "a / 2",
+    "-7 / 2",
+    "a / 0",
+    "x / b",
+    "x * 2 + a",
+    "-a",
+    "flag + 1",
+    "flag / b",
+    "big / 3",
+    "big % 7",
+    "big + 1",
+    "big * 16",
+    "a * 4611686018427387904",
+    "a > b",
+    "a = 7 AND b = 2",
+    "NOT a > b OR x IS NULL",
+    "a BETWEEN 1 AND 7",
+    "a IN (1, 4, 9)",
+    "s LIKE 'a%'",
+    "s NOT LIKE '%e%'",
+    "s || '-' || a",
+    "UPPER(s)",
+    "LENGTH(s)",
+    "SUBSTR(s, 2, 3)",
+    "COALESCE(s, 'none')",
+    "NULLIF(a, 7)",
+    "ABS(x)",
+    "ROUND(x, 1)",
+    "CASE WHEN a > 5 THEN 'big' WHEN a > 0 THEN 'small' ELSE 'neg' END",
+    "CASE a WHEN 7 THEN 1 WHEN 1 THEN 2 END",
+    "date(d)",
+    "date(d, '+1 day')",
+    "date(d, 'start of month')",
+    "date(d, 'start of year', '+1 month')",
+    "datetime(d, '+90 minutes')",
+    "time(d)",
+    "julianday(d)",
+    "strftime('%Y-%m', d)",
+]
+
+
+def _normalize(values):
+    rc = []
+    for v in values:
+        if v is None or (isinstance(v, float) and math.isnan(v)):
+            rc.append(None)
+        elif isinstance(v, (int, np.integer)):
+            rc.append(int(v))
+        elif isinstance(v, (float, np.floating)):
+            rc.append(pytest.approx(float(v), rel=1e-12, abs=1e-9))
+        else:
+            rc.append(v)
+    return rc
+
+
+@pytest.mark.parametrize("query", EXPRESSIONS)
+def test_matches_sqlite(ds, query):
+    expected = xforms.sqlite_new(ds, "r", query, engine="sqlite")["r"]
+    actual = xforms.sqlite_new(ds, "r", query, engine="auto")["r"]
+    assert _normalize(actual) == _normalize(expected)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "a / b",
+        "a % b",
+        "date(d, '+1 day')",
+        "julianday(d)",
+        "strftime('%Y-%m', d)",
+        "date(d, 'start of month')",
+    ],
+)
+def test_compiled(ds, query):
+    assert xforms.sqlite_engine(ds, query) == "pandas"
+
+
+@pytest.mark.parametrize("query", ["big * 16", "big + big", "a * 4611686018427387904"])
+def test_overflow_falls_back(ds, query):
+    with pytest.raises(sql_compiler.UnsupportedExpression):
+        sql_compiler.evaluate(ds, query)
+
+
+def test_sqlite_wide_frame():
+    wide = pd.DataFrame(np.arange(12000 * 40).reshape(12000, 40)).add_prefix("c")
+    rc = xforms.sqlite_new(wide, "r", "c0 + c39", engine="sqlite")
+    assert list(rc["r"][:2]) == [39, 119]
+
+
+def test_input_unchanged(ds):
+    before = ds.copy()
+    rc = xforms.sqlite_new(ds, "a", "a * 2")
+    assert list(rc["a"]) == [14, 2, -14, 8, 18]
+    pd.testing.assert_frame_equal(ds, before)
@@ -0,0 +1,12 @@
+import pandas as pd
+import pytest
+
+import xforms
+
+
+@pytest.mark.parametrize("freq", ["day", "week", "month"])
+def test_sorted_by_date(freq):
+    ds = pd.DataFrame({"d": ["2024-01-03", "2024-01-01", "2024-01-05"], "v": [3, 1, 5]})
+    rc = xforms.zero_fill(ds, {"d": "date", "v": "integer"}, freq=freq)
+    assert rc["d"].is_monotonic_increasing
+    assert list(rc["v"][rc["v"] != 0]) == [1, 3, 5]
@@ -1,14 +1,23 @@
-import html
 import numpy as np
 import pandas as pd
 import warnings
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import sqlite3
-from IPython.core.display import display, HTML
+import hashlib
+import itertools
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+from xforms import sql_compiler
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:
+    from pandas._libs.tslibs.parsing import guess_datetime_format
 
 
 def adapter(fn):
@@ -26,7 +35,11 @@ def adapter(fn):
     return wrapper
 
 
-def format(x, pos):
+# Plotting libraries are slow to import, so they are only imported by
+# the chart functions which need them.
+
+
+def _format_number(x, pos):
     m = 0
     while abs(x) >= 1000:
         m += 1
@@ -34,7 +47,15 @@ def format(x, pos):
     return "%.2f%s" % (x, ["", "K", "M", "B", "T"][m])
 
 
-number_formatter = FuncFormatter(format)
+def __getattr__(name):
+    # number_formatter needs matplotlib, so create it on first use
+    if name == "number_formatter":
+        from matplotlib.ticker import FuncFormatter
+
+        global number_formatter
+        number_formatter = FuncFormatter(_format_number)
+        return number_formatter
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def transpose(ds):
@@ -50,32 +71,69 @@ def column_ratio_new(ds, new_col, dividend, divisor):
     return divide_new(ds, new_col, dividend, divisor)
 
 
+def _widen(values):
+    """
+    Returns numbers stored in fewer than 64 bits (see xforms.dtypes) as
+    64 bit ones, so arithmetic on them gives the same results as on the
+    original columns
+    """
+    dtype = values.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "iuf" and dtype.itemsize < 8:
+        return values.astype(np.float64 if dtype.kind == "f" else np.int64)
+    return values
+
+
+def _decode(values):
+    """
+    Returns a categorical (see xforms.dtypes) as the values it encodes,
+    for operations which treat categories differently from plain values
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(values.cat.categories.dtype)
+    return values
+
+
+def _restore(ds):
+    """
+    Returns ds with every column narrowed by xforms.dtypes widened and
+    decoded again, for code outside our control like custom functions
+    """
+    rc = ds
+    for i, (_, values) in enumerate(ds.items()):
+        restored = _decode(_widen(values))
+        if restored is not values:
+            if rc is ds:
+                rc = ds.copy(deep=False)
+            rc.isetitem(i, restored)
+    return rc
+
+
 def subtract_new(ds, new_col, minuend, subtrahend):
     rc = ds
-    rc[new_col] = ds[minuend] - ds[subtrahend]
+    rc[new_col] = _widen(ds[minuend]) - _widen(ds[subtrahend])
     return rc
 
 
 def multiply_new(ds, new_col, multiplicand_1, multiplicand_2):
     rc = ds
     if type(multiplicand_1) == str:
-        multiplicand_1 = ds[multiplicand_1]
+        multiplicand_1 = _widen(ds[multiplicand_1])
     if type(multiplicand_2) == str:
-        multiplicand_2 = ds[multiplicand_2]
+        multiplicand_2 = _widen(ds[multiplicand_2])
     rc[new_col] = multiplicand_1 * multiplicand_2
     return rc
 
 
 def add_new(ds, new_col, addend_1, addend_2):
     rc = ds
-    rc[new_col] = ds[addend_1] + ds[addend_2]
+    rc[new_col] = _widen(ds[addend_1]) + _widen(ds[addend_2])
     return rc
 
 
 def divide_new(ds, new_col, dividend, divisor):
     rc = ds
     if dividend in ds.columns and divisor in ds.columns:
-        rc[new_col] = ds[dividend] / ds[divisor]
+        rc[new_col] = _widen(ds[dividend]) / _widen(ds[divisor])
     else:
         rc[new_col] = pd.Series(dtype="float")
     return rc
@@ -83,20 +141,77 @@ def divide_new(ds, new_col, dividend, divisor):
 
 def total_column_sum_new(ds, new_col):
     rc = ds
-    rc[new_col] = ds.sum(axis=1)
+    rc[new_col] = ds.apply(_widen).sum(axis=1)
     return rc
 
 
+def _string_dtype():
+    """
+    Returns pandas' Arrow-backed string dtype if pyarrow is installed,
+    which slices and concatenates without Python objects
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return pd.StringDtype()
+    return pd.StringDtype("pyarrow")
+
+
+def _strings(values):
+    """
+    Returns values as a string column, with nulls kept as nulls
+    """
+    if isinstance(values.dtype, pd.StringDtype):
+        return values
+    return values.astype(_string_dtype())
+
+
+def _string_op(fn, ds, columns):
+    """
+    Applies fn, which combines string columns into one, to ds[columns].
+    Without pyarrow, string operations loop in Python, so fn is only
+    applied to each distinct combination of values when they repeat.
+    """
+    if _string_dtype().storage != "pyarrow" and len(ds):
+        codes, ngroups = None, 0
+        for col in columns:
+            col_codes, uniques = pd.factorize(ds[col])
+            n = len(uniques)
+            if (col_codes < 0).any():
+                # nulls are a value of their own
+                col_codes = np.where(col_codes < 0, n, col_codes)
+                n += 1
+            if codes is None:
+                codes, ngroups = col_codes, n
+            else:
+                codes, combined = pd.factorize(codes * n + col_codes)
+                ngroups = len(combined)
+
+        if ngroups <= len(ds) // 2:
+            first = np.empty(ngroups, dtype="int64")
+            first[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+            distinct = [_strings(ds[c].iloc[first]) for c in columns]
+            rc = fn(*[d.reset_index(drop=True) for d in distinct])
+            return pd.Series(rc.array.take(codes), index=ds.index)
+    return fn(*[_strings(ds[c]) for c in columns])
+
+
 def markdown_link_new(ds, new_col, link, title):
-    rc = ds
+    """
+    Adds a column of [title](link) markdown links, null where the title
+    or link is null
+    """
     i = 0
 
     final_col_name = new_col
-    while final_col_name in rc.columns:
+    while final_col_name in ds.columns:
         i += 1
         final_col_name = f"{new_col}:{i}"
 
-    rc[final_col_name] = f"[{ds[title]}]({ds[link]})"
+    rc = ds.copy(deep=False)
+    rc[final_col_name] = _string_op(
+        lambda title, link: "[" + title + "](" + link + ")", ds, [title, link]
+    )
     return rc
 
 
@@ -104,41 +219,142 @@ def aggregation_new(ds, new_col, source, operation):
     if operation != "sum":
         raise Exception(f"Aggregating with {operation} is not supported")
     rc = ds
-    rc[new_col] = ds[source].sum()
+    rc[new_col] = _widen(ds[source]).sum()
     return rc
 
 
 def running_total_new(ds, new_col, source):
     rc = ds
-    rc[new_col] = ds[source].cumsum()
+    rc[new_col] = _widen(ds[source]).cumsum()
     return rc
 
 
 def ratio_of_total_new(ds, new_col, source):
     rc = ds
-    rc[new_col] = ds[source] / ds[source].sum()
+    values = _widen(ds[source])
+    rc[new_col] = values / values.sum()
     return rc
 
 
+# Calendar increments as a number of (days, months)
+CALENDAR_INCREMENTS = {
+    "day": (1, 0),
+    "week": (7, 0),
+    "month": (0, 1),
+    "quarter": (0, 3),
+    "year": (0, 12),
+}
+
+DATE_FORMAT_CACHE_SIZE = 256
+_date_formats = OrderedDict()
+
+NS_PER_DAY = 86400 * 10 ** 9
+
+
+def _date_format(sample):
+    """
+    Guesses the format of a date string. Guesses are cached by the
+    string's shape, so all dates written the same way share one.
+    """
+    shape = "".join("0" if c.isdigit() else c for c in sample)
+    fmt = _lru_get(_date_formats, shape)
+    if fmt is None:
+        fmt = guess_datetime_format(sample) or ""
+        _lru_put(_date_formats, shape, fmt, DATE_FORMAT_CACHE_SIZE)
+    return fmt or None
+
+
+def _to_datetime(values):
+    """
+    Returns values as naive datetime64[ns], parsing strings with the
+    format of the first one. Values which can't be parsed become NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if getattr(values.dt, "tz", None) is not None:
+            values = values.dt.tz_localize(None)
+        return values.to_numpy(dtype="datetime64[ns]")
+
+    notnull = values.dropna()
+    if len(notnull) and isinstance(notnull.iloc[0], str):
+        fmt = _date_format(notnull.iloc[0])
+        rc = pd.to_datetime(values, format=fmt, errors="coerce")
+        unparsed = rc.isna() & values.notna()
+        if fmt and unparsed.any():
+            # some dates are written differently
+            rc[unparsed] = pd.to_datetime(values[unparsed], errors="coerce")
+        return rc.to_numpy(dtype="datetime64[ns]")
+    return pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[ns]")
+
+
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def _month_offsets(ns):
+    """
+    Splits datetime64[ns] values into months since year 0, the day within
+    their month (from 0), the time of day and the length of their month
+    in days. This uses integer arithmetic on days since 1970
+    (https://howardhinnant.github.io/date_algorithms.html#civil_from_days),
+    which is much faster than converting to datetime64[M].
+    """
+    ns = ns.astype("int64")
+    days, time = np.divmod(ns, NS_PER_DAY)
+
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5
+    month = np.where(mp < 10, mp + 2, mp - 10)
+    year = yoe + era * 400 + (month < 2)
+
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    length = DAYS_IN_MONTH[month] + (leap & (month == 1))
+    return year * 12 + month, day, time, length
+
+
 def datediff_new(ds, new_col, start, end, increment):
-    if increment == "day":
-        inc = "D"
-    elif increment == "week":
-        inc = "W"
-    elif increment == "month":
-        inc = "M"
-    elif increment == "year":
-        inc = "Y"
+    """
+    Counts the whole increments (day, week, month, quarter or year) from
+    start to end. Months are calendar months, so Jan 15 to Feb 15 is one
+    month, and a start at the end of a longer month is treated as the end
+    of a shorter one. Rows where either date is null are null.
+    """
+    if increment not in CALENDAR_INCREMENTS:
+        raise Exception(f"Unknown datediff increment {increment}")
+    days, months = CALENDAR_INCREMENTS[increment]
+
+    start_ns = _to_datetime(ds[start])
+    end_ns = _to_datetime(ds[end])
+    nulls = np.isnat(start_ns) | np.isnat(end_ns)
+
+    if days:
+        diff = end_ns.astype("int64") - start_ns.astype("int64")
+        diff = diff // (days * NS_PER_DAY)
+    else:
+        start_month, start_day, start_time, _ = _month_offsets(start_ns)
+        end_month, end_day, end_time, end_length = _month_offsets(end_ns)
 
+        # the month isn't complete if end is earlier in its month than
+        # start is, with start's day limited to the length of end's month
+        start_day = np.minimum(start_day, end_length - 1)
+        early = (end_day < start_day) | ((end_day == start_day) & (end_time < start_time))
+        diff = (end_month - start_month - early) // months
+
+    diff[nulls] = 0
     rc = ds
-    rc[new_col] = rc[end] - rc[start]
-    rc[new_col] = rc[new_col] / np.timedelta64(1, inc)
-    rc[new_col] = rc[new_col].apply(np.floor)
+    rc[new_col] = pd.arrays.IntegerArray(diff.astype("int64"), nulls)
     return rc
 
 
 def substr_new(ds, new_col, source, start=None, end=None):
-    rc = ds
+    """
+    Adds a column of 'end' characters of source starting from 'start',
+    which counts from 1. Nulls stay null.
+    """
+    rc = ds.copy(deep=False)
 
     if start is None:
         start = 0
@@ -148,88 +364,382 @@ def substr_new(ds, new_col, source, start=None, end=None):
     if end is not None:
         end = start + end
 
-
-    converted = rc[source].apply(lambda x: str(x) if x else '')
-    rc[new_col] = converted.str[start:end]
+    rc[new_col] = _string_op(lambda s: s.str.slice(start, end), ds, [source])
     return rc
 
 
-def custom_new(ds, new_col, function):
+def _apply_rows(function, chunk):
+    """
+    Applies function to each row of chunk. Warnings are returned
+    alongside the result so they can be re-raised by the parent process
+    when this runs in a worker.
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        rc = chunk.apply(adapter(function), axis=1, result_type="reduce")
+    return rc, [(w.message, w.category) for w in caught]
+
+
+def _apply_batch(function, chunk):
+    """
+    Passes the whole chunk to function. If it raises one of the errors
+    handled by adapter(), the chunk is evaluated row by row instead so
+    each row gets the same result it would have in row mode.
+    """
+    try:
+        rc = function(chunk)
+    except (KeyError, ValueError, ZeroDivisionError):
+        return _apply_rows(function, chunk)
+
+    if isinstance(rc, pd.Series):
+        rc = rc.values
+    return pd.Series(rc, index=chunk.index), []
+
+
+def custom_new(ds, new_col, function, mode="row", chunk_size=100000, workers=None):
+    """
+    Adds a new column computed by 'function'.
+
+    mode: "row" calls function with each row. "batch" calls function with
+          DataFrame chunks of up to chunk_size rows, and it must return one
+          value per row.
+
+    workers: Number of processes to spread the chunks across. The function
+             must be picklable, i.e. defined at the top level of a module.
+    """
     rc = ds
-    rc[new_col] = ds.apply(adapter(function), axis=1, result_type="reduce")
+    # the function sees the values of the original, unoptimized columns
+    ds = _restore(ds)
+
+    if mode == "row" and not workers:
+        rc[new_col] = ds.apply(adapter(function), axis=1, result_type="reduce")
+        return rc
+
+    if mode == "row":
+        apply = _apply_rows
+    elif mode == "batch":
+        apply = _apply_batch
+    else:
+        raise Exception(f"custom_new mode {mode} is not supported")
+
+    if workers and len(ds):
+        chunk_size = min(chunk_size, -(-len(ds) // workers))
+    chunks = [ds.iloc[i : i + chunk_size] for i in range(0, len(ds), chunk_size)]
+
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(apply, [function] * len(chunks), chunks))
+    else:
+        results = [apply(function, chunk) for chunk in chunks]
+
+    for _, caught in results:
+        for message, category in caught:
+            warnings.warn(message, category)
+
+    if results:
+        rc[new_col] = pd.concat([values for values, _ in results])
+    else:
+        rc[new_col] = pd.Series(dtype="object")
     return rc
 
 
-def sqlite_new(ds, new_col, query, column_types=None):
+log = logging.getLogger(__name__)
+
+
+def _fingerprint(ds):
     """
-    Executes 'query' against the data as a sqlite database
-    and returns the result as a new column
+    Returns a hash of the contents of a dataset, including its column
+    names and types, or None if the data can't be hashed.
     """
+    h = hashlib.sha256()
+    h.update(repr([(str(c), str(t)) for c, t in ds.dtypes.items()]).encode())
+    h.update(str(len(ds)).encode())
+
+    for i in range(len(ds.columns)):
+        values = ds.iloc[:, i].values
+        if isinstance(values, np.ndarray) and values.dtype.kind in "biufcmM":
+            # hash numbers and dates by their raw bytes
+            h.update(np.ascontiguousarray(values).view(np.uint8))
+            continue
+        try:
+            hashed = pd.util.hash_pandas_object(pd.Series(values), index=False)
+        except TypeError:
+            return None
+        h.update(hashed.values)
 
-    # Import data into an in-memory sqlite instance
-    with sqlite3.connect(":memory:") as conn:
-        table_name = "ds"
-        ds.to_sql(name=table_name, con=conn, index=False)
+        if values.dtype == object and pd.api.types.infer_dtype(
+            values, skipna=False
+        ) not in ("string", "empty"):
+            # values are hashed as strings, so 1 and "1" only differ by type
+            types = pd.Series([type(v).__name__ for v in values], dtype=object)
+            h.update(pd.util.hash_pandas_object(types, index=False).values)
 
-        # Run new SQL query and add custom code as new column
-        sql = f"SELECT *, {query} as '{new_col}' from {table_name}"
-        rc = pd.read_sql(sql, conn)
+    return h.hexdigest()
 
-    return rc
 
+# Maps our column types to the sqlite type used when staging the data
+SQLITE_TYPES = {
+    "text": "TEXT",
+    "date": "TEXT",
+    "integer": "INTEGER",
+    "real": "REAL",
+    "percentage": "REAL",
+    "currency": "REAL",
+}
 
-def case_statement_new(
-    ds, new_col, source, conditions, default, default_type="LITERAL"
-):
-    rc = ds
+# Number of staged datasets to keep loaded in sqlite
+SQLITE_CACHE_SIZE = 8
 
-    if default_type == "COLUMN":
-        rc[new_col] = rc[default]
+# sqlite's default limit on the variables bound in one statement
+SQLITE_MAX_VARIABLES = 32766
+
+_sqlite_lock = threading.Lock()
+_sqlite_conn = None
+_sqlite_tables = OrderedDict()
+_sqlite_table_ids = itertools.count()
+
+
+def _sqlite_table(ds, column_types=None):
+    """
+    Returns the name of a table in the shared sqlite connection holding
+    the contents of ds, loading it if it hasn't been staged already.
+    Must be called while holding _sqlite_lock.
+    """
+    global _sqlite_conn
+
+    if _sqlite_conn is None:
+        _sqlite_conn = sqlite3.connect(":memory:", check_same_thread=False)
+
+    column_types = column_types or {}
+    dtype = {}
+    for col_name in ds.columns:
+        sqlite_type = SQLITE_TYPES.get(column_types.get(col_name))
+        if sqlite_type:
+            dtype[col_name] = sqlite_type
+
+    fingerprint = _fingerprint(ds)
+    if fingerprint is None:
+        key = None
     else:
-        rc[new_col] = default
+        key = (fingerprint, tuple(sorted(dtype.items())))
+        if key in _sqlite_tables:
+            _sqlite_tables.move_to_end(key)
+            return _sqlite_tables[key]
+
+    table_name = f"ds_{next(_sqlite_table_ids)}"
+    ds.to_sql(
+        name=table_name,
+        con=_sqlite_conn,
+        index=False,
+        if_exists="replace",
+        dtype=dtype or None,
+        # each multi-row INSERT binds one variable per cell
+        chunksize=max(1, SQLITE_MAX_VARIABLES // max(len(ds.columns), 1)),
+        method="multi" if len(ds.columns) < 50 else None,
+    )
 
-    for condition in conditions:
-        value = condition["value"]
-        value_type = condition["value_type"]
-        operand = condition["operand"]
-        operator = condition["operator"]
+    if key is None:
+        return table_name
 
-        if value_type == "COLUMN":
-            value = rc[value]
+    _sqlite_tables[key] = table_name
+    while len(_sqlite_tables) > SQLITE_CACHE_SIZE:
+        _, evicted = _sqlite_tables.popitem(last=False)
+        _sqlite_conn.execute(f'DROP TABLE IF EXISTS "{evicted}"')
 
-        # determine the operand type
+    return table_name
 
-        if operator == "LIKE":
-            # None of the LIKE operators in the data have percent signs
-            operator = "="
 
-        # the data doesn't contain NOT LIKE
+def _sqlite_eval(ds, queries, column_types=None):
+    """
+    Evaluates each of the sqlite expressions in 'queries' against ds
+    with a single SELECT and returns a list with the values of each query
+    """
+    with _sqlite_lock:
+        table_name = _sqlite_table(ds, column_types)
 
-        # TODO: determine whether values should be compared using int or str
+        expressions = ", ".join(
+            f"{query} as \"col_{i}\"" for i, query in enumerate(queries)
+        )
+        sql = f'SELECT {expressions} from "{table_name}" ORDER BY rowid'
+        rc = pd.read_sql(sql, _sqlite_conn)
 
-        if operator in ["=", "!=", ">", ">=", "<", "<="]:
-            fn = {
-                "=": "eq",
-                "!=": "ne",
-                ">": "gt",
-                ">=": "ge",
-                "<": "lt",
-                "<=": "le",
-            }
-            f = getattr(rc[source], fn[operator])
-            rc.loc[f(operand), new_col] = value
+        if table_name not in _sqlite_tables.values():
+            _sqlite_conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
 
-        elif operator == "IS NOT" and operand == "null":
-            rc.loc[pd.notnull(rc[source]), new_col] = value
+    return [rc.iloc[:, i].values for i in range(len(queries))]
 
-        elif operator == "IS" and operand == "null":
-            rc.loc[pd.isnull(rc[source]), new_col] = value
 
-        elif operator == "IS" and operand == "''":
-            rc.loc[rc[source] == "", new_col] = value
+def sqlite_new(ds, new_col, query, column_types=None, engine="auto"):
+    """
+    Executes 'query' against the data as a sqlite database
+    and returns the result as a new column
+    """
+    return sqlite_batch_new(
+        ds, {new_col: query}, column_types=column_types, engine=engine
+    )
 
-        else:
-            raise Exception(f"{operator} is not supported")
+
+def sqlite_batch_new(ds, queries, column_types=None, engine="auto"):
+    """
+    Executes several sqlite expressions against the data at once.
+    'queries' is a dict where the key is the new column name and the
+    value is the expression.
+
+    engine: "auto" evaluates simple expressions directly with pandas and
+            runs anything else in sqlite. "pandas" or "sqlite" force one
+            path, and "pandas" raises if an expression isn't supported.
+            The path taken for each expression is logged at DEBUG level
+            and can be checked ahead of time with sqlite_engine().
+
+    The data is staged in a shared sqlite database and reused by later
+    queries against the same data. column_types, if given, determines the
+    sqlite type of each staged column.
+    """
+    results = {}
+    remaining = {}
+    for new_col, query in queries.items():
+        if engine != "sqlite":
+            try:
+                results[new_col] = sql_compiler.evaluate(ds, query).values
+                log.debug("sqlite_new %r: evaluated with pandas", query)
+                continue
+            except sql_compiler.UnsupportedExpression as e:
+                if engine == "pandas":
+                    raise
+                log.debug("sqlite_new %r: running in sqlite (%s)", query, e)
+        remaining[new_col] = query
+
+    if remaining:
+        values = _sqlite_eval(ds, list(remaining.values()), column_types)
+        results.update(zip(remaining, values))
+
+    rc = ds.copy(deep=False)
+    for new_col in queries:
+        rc[new_col] = results[new_col]
+    return rc
+
+
+def sqlite_engine(ds, query):
+    """
+    Returns "pandas" if 'query' would be evaluated directly with pandas,
+    or "sqlite" if it would be run in sqlite
+    """
+    try:
+        sql_compiler.evaluate(ds, query)
+    except sql_compiler.UnsupportedExpression:
+        return "sqlite"
+    return "pandas"
+
+
+CASE_PLAN_CACHE_SIZE = 256
+_case_plans = OrderedDict()
+
+
+class CasePlan:
+    """
+    A compiled list of case_statement_new() conditions. LIKE patterns are
+    compiled once, and each is only matched against the distinct values
+    of the source column.
+    """
+
+    def __init__(self, conditions):
+        self.tests = []
+        for condition in conditions:
+            operand = condition["operand"]
+            operator = condition["operator"]
+
+            if operator in ("LIKE", "NOT LIKE"):
+                # sqlite's LIKE is case insensitive for ASCII characters
+                operand = re.compile(
+                    sql_compiler.like_regex(str(operand)), re.IGNORECASE | re.DOTALL
+                )
+            elif operator in ("IS", "IS NOT") and operand == "null":
+                pass
+            elif operator == "IS" and operand == "''":
+                pass
+            elif operator not in FILTER_METHODS:
+                raise Exception(f"{operator} is not supported")
+            self.tests.append((operator, operand))
+
+    def _like(self, source, pattern, distinct):
+        if distinct[0] is None:
+            codes, uniques = pd.factorize(source)
+            distinct[0] = (codes, [str(u) for u in uniques])
+        codes, uniques = distinct[0]
+        # code -1 (null) picks the False at the end
+        matched = [pattern.fullmatch(u) is not None for u in uniques] + [False]
+        return np.array(matched)[codes]
+
+    def masks(self, source):
+        """
+        Returns a boolean array for each condition, marking the rows of
+        source it matches
+        """
+        rc = []
+        distinct = [None]
+        for operator, operand in self.tests:
+            if operator == "LIKE":
+                mask = self._like(source, operand, distinct)
+            elif operator == "NOT LIKE":
+                # NULL NOT LIKE x is NULL, which doesn't match
+                mask = ~self._like(source, operand, distinct) & source.notnull().values
+            elif operator == "IS":
+                mask = source.isnull() if operand == "null" else source == ""
+            elif operator == "IS NOT":
+                mask = source.notnull()
+            else:
+                mask = _compare(source, operator, operand)
+            if isinstance(mask, pd.Series):
+                # treat NA in nullable columns like None in object columns
+                mask = mask.to_numpy(dtype=bool, na_value=operator == "!=")
+            rc.append(mask)
+        return rc
+
+
+def compile_case(conditions):
+    """
+    Returns a CasePlan for the conditions, reusing a previously compiled
+    one where possible
+    """
+    key = json.dumps(
+        [(c["operator"], c["operand"]) for c in conditions], default=_key_operand
+    )
+    plan = _lru_get(_case_plans, key)
+    if plan is None:
+        plan = CasePlan(conditions)
+        _lru_put(_case_plans, key, plan, CASE_PLAN_CACHE_SIZE)
+    return plan
+
+
+def case_statement_new(
+    ds, new_col, source, conditions, default, default_type="LITERAL"
+):
+    """
+    Adds a column with the value of the first condition matching source,
+    or default if none do, like a SQL CASE statement. Values (and the
+    default) are literals or, with a value_type of COLUMN, column names.
+    """
+    rc = ds
+
+    masks = compile_case(conditions).masks(ds[source])
+    # the number of the first matching condition, len(masks) for none
+    branch = np.select(masks, np.arange(len(masks)), default=len(masks))
+
+    values = [(c["value"], c["value_type"]) for c in conditions]
+    values.append((default, default_type))
+
+    if all(value_type != "COLUMN" for _, value_type in values):
+        lookup = pd.Series([value for value, _ in values]).to_numpy()
+        rc[new_col] = lookup[branch]
+    else:
+        result = np.empty(len(ds), dtype=object)
+        for i, (value, value_type) in enumerate(values):
+            selected = branch == i
+            if value_type == "COLUMN":
+                result[selected] = ds[value].to_numpy()[selected]
+            else:
+                result[selected] = value
+        rc[new_col] = pd.Series(result, index=ds.index).infer_objects()
 
     return rc
 
@@ -248,7 +758,7 @@ def divide(ds, col, divisor):
 
 def round(ds, col, places):
     rc = ds
-    rc[col] = ds[col].round(places)
+    rc[col] = _widen(ds[col]).round(places)
     return rc
 
 
@@ -264,50 +774,101 @@ def format(ds, col, arg):
     return rc
 
 
-def custom(ds, col, function):
-    return custom_new(ds, col, adapter(function))
+def custom(ds, col, function, mode="row", chunk_size=100000, workers=None):
+    return custom_new(
+        ds, col, function, mode=mode, chunk_size=chunk_size, workers=workers
+    )
+
+
+def sqlite(ds, col, query, column_types=None, engine="auto"):
+    rc = sqlite_batch_new(ds, {col: query}, column_types=column_types, engine=engine)
+    return rc
+
 
+# NumPy functions reducing the columns of combine_columns()
+COMBINE_OPERATORS = {
+    "add": np.add,
+    "subtract": np.subtract,
+    "multiply": np.multiply,
+}
 
-def sqlite(ds, col, query, column_types=None):
-    # Perform the computation as a new temporary column,
-    # then replace the old column with the new data
-    temp_column = "hotswap_temp"
+# dtypes combine_columns() can do arithmetic in, and the nullable arrays
+# used for them
+COMBINE_DTYPES = {
+    "int64": pd.arrays.IntegerArray,
+    "float32": pd.arrays.FloatingArray,
+    "float64": pd.arrays.FloatingArray,
+}
 
-    rc = sqlite_new(ds, temp_column, query, column_types=column_types)
-    rc[col] = rc[temp_column]
 
-    return remove_columns(rc, [temp_column])
+def _combine_numbers(ds, columns, operator, dtype):
+    """
+    Reduces the columns with one NumPy call over a 2-D array. Rows with
+    a null in any column are null. The result is nullable if any column
+    is, or if nulls would otherwise be lost converting to integers.
+    """
+    if dtype not in COMBINE_DTYPES:
+        raise Exception(f"combine_columns does not support dtype {dtype}")
+
+    stacked = np.empty((len(columns), len(ds)), dtype=dtype)
+    nulls = np.zeros(len(ds), dtype=bool)
+    nullable = False
+    for i, col in enumerate(columns):
+        values = ds[col]
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf":
+            # NumPy columns are copied in directly, nulls being NaN
+            if values.dtype.kind == "f":
+                nulls |= np.isnan(values.to_numpy())
+            with np.errstate(invalid="ignore"):
+                stacked[i] = values.to_numpy()
+        else:
+            nullable |= pd.api.types.is_extension_array_dtype(values)
+            nulls |= values.isnull().to_numpy()
+            stacked[i] = values.to_numpy(dtype=dtype, na_value=0)
+
+    rc = COMBINE_OPERATORS[operator].reduce(stacked, axis=0)
+    if nullable or (dtype == "int64" and nulls.any()):
+        return COMBINE_DTYPES[dtype](rc, nulls)
+    if nulls.any():
+        rc[nulls] = np.nan
+    return rc
 
 
 def combine_columns(
-    ds, new_col, columns, separator=",", operator="concatenate", hide_columns=False
+    ds,
+    new_col,
+    columns,
+    separator=",",
+    operator="concatenate",
+    hide_columns=False,
+    dtype=None,
 ):
-    rc = ds
+    """
+    Adds a column combining 'columns', either concatenated as text with
+    'separator' or reduced with add, subtract or multiply. Arithmetic is
+    done in dtype: int64, float32 or float64 (the default).
+
+    hide_columns: Remove the combined columns from the result
+    """
+    rc = ds.copy(deep=False)
 
     if operator == "concatenate":
-        for col in columns:
-            rc[col] = rc[col].astype(str)
-        rc[new_col] = rc[columns].agg(separator.join, axis=1)
+        def concatenate(first, *rest):
+            # null if any of the columns is null
+            for values in rest:
+                first = first + separator + values
+            return first
 
-    elif operator in ("add", "subtract", "multiply"):
-        for col in columns:
-            rc[col] = rc[col].astype(float)
-
-        cols = [ds[col] for col in columns]
-        rc[new_col] = cols[0]
-        for col in cols[1:]:
-            if operator == "add":
-                rc[new_col] = rc[new_col].add(col)
-            elif operator == "subtract":
-                rc[new_col] = rc[new_col].sub(col)
-            elif operator == "multiply":
-                rc[new_col] = rc[new_col].multiply(col)
+        rc[new_col] = _string_op(concatenate, ds, columns)
+
+    elif operator in COMBINE_OPERATORS:
+        rc[new_col] = _combine_numbers(ds, columns, operator, dtype or "float64")
 
     else:
         raise Exception(operator + " is unsupported")
 
     if hide_columns:
-        rc = ds.drop(columns, errors="ignore")
+        rc = rc.drop(columns=[c for c in columns if c != new_col], errors="ignore")
 
     return rc
 
@@ -319,33 +880,116 @@ def unpivot(ds, group_alias, values_alias):
     return rc
 
 
-def zero_fill(ds, column_types):
-    rc = ds
+def _calendar_slots(dates, freq):
+    """
+    Numbers the calendar slots (days, weeks...) from the earliest date,
+    returning the slot of each date (NaN for nulls) and a function
+    returning the date of slots
+    """
+    if freq not in CALENDAR_INCREMENTS:
+        raise Exception(f"unsupported zero_fill frequency {freq}")
+    days, months = CALENDAR_INCREMENTS[freq]
+    start = dates.min()
+    if pd.isna(start):
+        return pd.Series(np.nan, index=dates.index), lambda n: pd.DatetimeIndex([])
+
+    if days:
+        slots = (dates.dt.normalize() - start.normalize()).dt.days // days
+        return slots, lambda n: start + pd.to_timedelta(n * days, unit="D")
+
+    # count calendar months (or quarters) from the one start is in
+    slots = (dates.dt.year - start.year) * 12 + dates.dt.month - 1
+    slots = slots // months - (start.month - 1) // months
+    return slots, lambda n: pd.DatetimeIndex(
+        [start + pd.DateOffset(months=int(m) * months) for m in n]
+    )
+
+
+def zero_fill(ds, column_types, freq="day", keys=None):
+    """
+    Adds a row for each date missing from the first column, and sets
+    nulls in integer and real columns to 0.
+
+    freq: day, week, month, quarter or year. Weeks start on the earliest
+          date, while months, quarters and years follow the calendar.
 
+    keys: Columns identifying separate series. Each series is filled
+          over the dates of the whole dataset.
+    """
     col_1_name = ds.columns[0]
     col_1_type = column_types[col_1_name]
+    keys = keys or []
 
     if col_1_type in ("text", "real", "integer"):
         # Do nothing for this zero_fill since the
         # first column is a string or real number
-        pass
+        rc = ds.copy()
 
     elif col_1_type == "date":
-        # Do something for this zero_fill since the first column is a date
-        col_1 = rc[col_1_name]
-        date_range = pd.date_range(col_1.min(), col_1.max(), freq="d")
-        diff = date_range.difference(col_1).to_frame()
-        diff.rename(columns={0: col_1_name}, inplace=True)
-        rc = rc.append(diff, ignore_index=True)
-        rc = rc.sort_values(col_1_name)
+        dates = pd.to_datetime(ds[col_1_name])
+        slots, calendar = _calendar_slots(dates, freq)
+        slots = slots.to_numpy(dtype=float, na_value=np.nan)
+        dated = ~np.isnan(slots)
+        nslots = int(np.nanmax(slots)) + 1 if dated.any() else 0
+
+        if keys:
+            key_codes, nkeys, first = _group_codes(ds, keys)
+        else:
+            key_codes, nkeys, first = np.zeros(len(ds), dtype="int64"), 1, [0]
+
+        # each (slot, series) cell without a row gets a new one, and rows
+        # are ordered by cell, which orders them by slot then series
+        ncells = nslots * nkeys
+        cells = slots[dated].astype("int64") * nkeys + key_codes[dated]
+        counts = np.bincount(cells, minlength=ncells)
+        missing = np.flatnonzero(counts == 0)
+        missing_slots, missing_keys = missing // nkeys, missing % nkeys
+
+        n = len(ds)
+        if counts.max(initial=0) <= 1:
+            # every cell now has exactly one row, so it's the row's position,
+            # followed by rows without a date
+            order = np.empty(n + len(missing), dtype="int64")
+            order[cells] = np.flatnonzero(dated)
+            order[missing] = np.arange(n, n + len(missing))
+            order[ncells:] = np.flatnonzero(~dated)
+        else:
+            order_key = np.full(n, ncells, dtype="int64")
+            order_key[dated] = cells
+            # rows sharing a week, month, etc. are ordered by their date
+            date_key = np.zeros(n + len(missing), dtype="int64")
+            date_key[:n][dated] = dates.array.asi8[dated]
+            order = np.lexsort((date_key, np.concatenate([order_key, missing])))
+
+        # positions of the new rows are -1, filled with nulls
+        rows = np.concatenate([np.arange(n), np.full(len(missing), -1)])[order]
+        added = rows < 0
+        key_rows = np.concatenate(
+            [np.arange(n), np.asarray(first, dtype="int64")[missing_keys]]
+        )[order]
+        new_dates = calendar(np.arange(nslots))[missing_slots[order[added] - n]]
+
+        columns = []
+        for i, col_name in enumerate(ds.columns):
+            if i == 0:
+                values = pd.api.extensions.take(dates.values, rows, allow_fill=True)
+                values[added] = new_dates
+            elif col_name in keys:
+                values = ds.iloc[:, i].values.take(key_rows)
+            else:
+                values = pd.api.extensions.take(
+                    ds.iloc[:, i].values, rows, allow_fill=True
+                )
+            columns.append(pd.Series(values, name=col_name))
+        rc = pd.concat(columns, axis=1)
 
     else:
         raise Exception("unsupported zero_fill column type " + col_1_type)
 
-    for col_name in ds.columns:
+    for col_name in rc.columns:
         type = column_types.get(col_name)
         if type in ("integer", "real"):
-            rc[col_name].fillna(0, inplace=True)
+            rc[col_name] = rc[col_name].fillna(0)
 
     return rc
 
@@ -369,173 +1013,518 @@ def reorder_columns(ds, columns):
     return rc
 
 
+def _group_codes(ds, columns, na_first=False):
+    """
+    Numbers the distinct combinations of values in 'columns', in sorted
+    order with nulls last (or first). Returns the group number of each row,
+    the number of groups and the position of the first row in each group.
+    """
+    codes = np.zeros(len(ds), dtype="int64")
+    ngroups = 1 if len(ds) else 0
+
+    for col in columns:
+        col_codes, uniques = pd.factorize(ds[col], sort=True)
+        n = len(uniques)
+        if (col_codes < 0).any():
+            if na_first:
+                col_codes = col_codes + 1
+            else:
+                col_codes = np.where(col_codes < 0, n, col_codes)
+            n += 1
+
+        if ngroups > 1:
+            # renumber so the codes stay dense as columns are added
+            codes, uniques = pd.factorize(codes * n + col_codes, sort=True)
+            ngroups = len(uniques)
+        else:
+            codes = col_codes.astype("int64")
+            ngroups = n
+
+    # assigning in reverse leaves the first row of each group
+    first = np.empty(ngroups, dtype="int64")
+    first[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+    return codes, ngroups, first
+
+
+class _Groups:
+    """
+    Computes aggregations over rows numbered by _group_codes()
+    """
+
+    def __init__(self, codes, ngroups):
+        self.codes = codes
+        self.ngroups = ngroups
+        self._order = None
+
+    def sorted(self):
+        """
+        Returns the row order which places the groups next to each other
+        (keeping the original order within a group), and where each
+        group starts in that order
+        """
+        if self._order is None:
+            order = np.argsort(self.codes, kind="stable")
+            starts = np.searchsorted(self.codes[order], np.arange(self.ngroups))
+            self._order = (order, starts)
+        return self._order
+
+    def count(self, values):
+        return np.bincount(
+            self.codes[values.notna().values], minlength=self.ngroups
+        ).astype("int64")
+
+    def sum(self, values):
+        if not isinstance(values.dtype, np.dtype):
+            # nullable and other extension arrays go to the pandas fallback
+            return None
+        if pd.api.types.is_float_dtype(values):
+            return np.bincount(
+                self.codes, weights=values.fillna(0).values, minlength=self.ngroups
+            )
+        if pd.api.types.is_integer_dtype(values) or pd.api.types.is_bool_dtype(values):
+            order, starts = self.sorted()
+            return np.add.reduceat(values.values.astype("int64")[order], starts)
+        return None
+
+    def mean(self, values):
+        if not pd.api.types.is_numeric_dtype(values):
+            return None
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.bincount(
+                self.codes, weights=values.astype("float64").fillna(0).values,
+                minlength=self.ngroups,
+            ) / self.count(values)
+
+    def _extreme(self, values, ufunc):
+        if not isinstance(values.dtype, np.dtype):
+            return None
+        if not pd.api.types.is_numeric_dtype(values) or values.dtype == bool:
+            return None
+        order, starts = self.sorted()
+        rc = ufunc.reduceat(values.values[order], starts)
+        return rc
+
+    def min(self, values):
+        return self._extreme(values, np.fmin)
+
+    def max(self, values):
+        return self._extreme(values, np.fmax)
+
+    def median(self, values):
+        if not pd.api.types.is_numeric_dtype(values):
+            return None
+        values = values.astype("float64").values
+        notnull = ~np.isnan(values)
+        codes = self.codes[notnull]
+        values = values[notnull]
+
+        # sort by group, then value, and pick the middle of each group
+        order = np.lexsort((values, codes))
+        values = values[order]
+        counts = np.bincount(codes, minlength=self.ngroups)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        rc = np.full(self.ngroups, np.nan)
+        has = counts > 0
+        lo = starts[has] + (counts[has] - 1) // 2
+        hi = starts[has] + counts[has] // 2
+        rc[has] = (values[lo] + values[hi]) / 2
+        return rc
+
+    def nunique(self, values):
+        value_codes, uniques = pd.factorize(values)
+        notnull = value_codes >= 0
+        pairs = self.codes[notnull] * max(len(uniques), 1) + value_codes[notnull]
+        pairs = np.unique(pairs)
+        return np.bincount(
+            pairs // max(len(uniques), 1), minlength=self.ngroups
+        ).astype("int64")
+
+    def group_concat(self, values):
+        order, starts = self.sorted()
+        ordered = values.values[order]
+        return np.array(
+            [", ".join(chunk) for chunk in np.split(ordered, starts[1:])]
+            if self.ngroups
+            else [],
+            dtype="object",
+        )
+
+
+# Maps group_by actions to the _Groups method computing them, and whether
+# the column should be converted to a number first.
+GROUP_BY_ACTIONS = {
+    "MIN": ("min", True),
+    "MAX": ("max", True),
+    "MEDIAN": ("median", True),
+    "AVG": ("mean", True),
+    "COUNT": ("count", True),
+    "SUM": ("sum", True),
+    "COUNT_DISTINCT": ("nunique", False),
+    "GROUP_CONCAT": ("group_concat", False),
+}
+
+
 def group_by(ds, columns):
+    """
+    Groups the data by every column that isn't a key in 'columns', and
+    aggregates the remaining ones. 'columns' maps each aggregated column
+    name to MIN, MAX, MEDIAN, AVG, COUNT, SUM, COUNT_DISTINCT or
+    GROUP_CONCAT. Groups are returned in sorted order with nulls last.
+    """
     ordered = ds.columns
 
     # get the columns to be grouped
     grouped_cols = [c for c in ordered if c not in columns.keys()]
 
-    agg = {}
-    rename = {}
-    
-    def to_numeric(name):
-        try:
-            ds[name] = pd.to_numeric(ds[name])
-        except:
-            pass
+    codes, ngroups, first = _group_codes(ds, grouped_cols)
+    groups = _Groups(codes, ngroups)
 
+    rc = {}
+    for col in grouped_cols:
+        rc[col] = ds[col].take(first).values
+
+    rename = {}
     for name, action in columns.items():
         if name not in ds.columns:
             continue
 
+        if action not in GROUP_BY_ACTIONS:
+            raise Exception(f"group_by aggregation {action} is not supported")
+        method, numeric = GROUP_BY_ACTIONS[action]
+
         if action == "COUNT_DISTINCT":
             rename[name] = f"COUNT(DISTINCT {name})"
         else:
             rename[name] = f"{action}({name})"
 
-        if action == "MIN":
-            method = "min"
-            to_numeric(name)
-        elif action == "MAX":
-            method = "max"
-            to_numeric(name)
-        elif action == "MEDIAN":
-            method = "median"
-            to_numeric(name)
-        elif action == "AVG":
-            method = "mean"
-            to_numeric(name)
-        elif action == "COUNT":
-            method = "count"
-            to_numeric(name)
-        elif action == "SUM":
-            method = "sum"
-            to_numeric(name)
-        elif action == "COUNT_DISTINCT":
-            method = "nunique"
-        elif action == "GROUP_CONCAT":
-            agg[name] = lambda x: ", ".join(x)
-            continue
-        agg[name] = method
-
-    rc = ds
-    if grouped_cols:
-        rc = ds.groupby(grouped_cols, as_index=False, dropna=False)
-    rc = rc.agg(agg)
-    if type(rc) == pd.Series:
-        rc = rc.to_frame().transpose()
-    rc = rc[ordered]
+        values = ds[name].reset_index(drop=True)
+        if numeric:
+            try:
+                values = pd.to_numeric(values)
+            except (ValueError, TypeError):
+                pass
+
+        result = getattr(groups, method)(values)
+        if result is None:
+            # fall back to pandas for types the vectorized path doesn't handle
+            values = _decode(values)
+            result = values.groupby(codes).agg(method).reindex(range(ngroups)).values
+        rc[name] = result
+
+    rc = pd.DataFrame(rc, columns=[c for c in ordered if c in rc])
     rc.rename(columns=rename, inplace=True)
 
     return rc
 
 
+class HistogramAccumulator:
+    """
+    Counts values into the buckets used by histogram_buckets(). Values
+    can be added in chunks, and accumulators built from different chunks
+    of the same data can be merged.
+    """
+
+    def __init__(self, custom_buckets):
+        self.breaks = np.asarray(custom_buckets)
+        self.counts = np.zeros(len(custom_buckets), dtype="int64")
+        self.max_value = None
+
+    def add(self, values):
+        values = pd.Series(values).dropna().values
+        if not len(values):
+            return self
+
+        # Values below the first bucket are counted in it, and the last
+        # bucket holds everything from its start up to the maximum.
+        idx = np.searchsorted(self.breaks, values, side="right") - 1
+        np.clip(idx, 0, None, out=idx)
+        self.counts += np.bincount(idx, minlength=len(self.counts))
+
+        max_value = values.max()
+        if self.max_value is None or max_value > self.max_value:
+            self.max_value = max_value
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        if self.max_value is None or (
+            other.max_value is not None and other.max_value > self.max_value
+        ):
+            self.max_value = other.max_value
+        return self
+
+    def result(self):
+        max_value = np.nan if self.max_value is None else self.max_value
+        breaks = np.append(self.breaks, max_value)
+
+        # rename the buckets appropriately
+        labels = [f"{breaks[i]}-{breaks[i + 1] - 1}" for i in range(len(breaks) - 2)]
+        labels.append(f"{breaks[-2]}-{breaks[-1]}")
+
+        rc = pd.DataFrame({"Bucket": labels, "Count": self.counts})
+        rc["Bucket"] = rc["Bucket"].astype("string")
+        return rc
+
+
 def histogram_buckets(ds, col, aggregation, bucket_type, custom_buckets):
     if aggregation != "COUNT":
         raise Exception("We only support COUNT aggregations in histograms")
 
     if bucket_type != "custom_buckets":
         raise Exception("We only support custom_buckets in histograms")
-    
-    # add the maximum value to the end of the buckets
-    max_value = ds[col].max()
-    custom_buckets.append(max_value)
-
-    bins = pd.IntervalIndex.from_breaks(custom_buckets, closed='left')
-    
-    binned = pd.cut(ds[col], bins=bins)
-    
-    # rename the buckets appropriately
-    categories = {}
-    for bin in bins:
-      categories[bin] = f"{bin.left}-{bin.right - 1}"
-    last = bins[-1]
-    categories[last] = f"{last.left}-{last.right}"
-    binned = binned.cat.rename_categories(categories)
-    
-    rc = binned.groupby(binned).size()
-    
-    # add the values before the bins
-    before = len(ds[ds[col] < custom_buckets[0]])
-    rc[0] += before
-    
-    # add the maximum values
-    max_count = len(ds[ds[col] == max_value])
-    rc[-1] += max_count
-    
-    rc = rc.to_frame().rename_axis(0)
-    rc.reset_index(inplace=True)
-    rc.rename(columns={0: "Bucket", rc.columns[1]: "Count"}, inplace=True)
-    rc['Bucket'] = rc['Bucket'].astype("string")
-    return rc
-
-
-def filter(ds, filters, match_type="all", mode="include"):
-    # filter definition
+
+    return HistogramAccumulator(custom_buckets).add(ds[col]).result()
+
+
+FILTER_METHODS = {
+    "=": "eq",
+    "!=": "ne",
+    ">": "gt",
+    ">=": "ge",
+    "<": "lt",
+    "<=": "le",
+}
+
+
+def _compare(values, operator, operand):
     """
-    {
-        "column": "col_name",
-        "operator": "<=",
-        "operand": "op",
-        "operand_type": "COLUMN", # or "LITERAL"
-    }
+    Compares values with operand using one of FILTER_METHODS. Categoricals
+    (see xforms.dtypes) are compared by category, so they give the same
+    results as the strings they encode, even with < and >.
+    """
+    method = FILTER_METHODS[operator]
+    if isinstance(operand, pd.Series) and isinstance(
+        operand.dtype, pd.CategoricalDtype
+    ):
+        operand = operand.astype(object)
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return getattr(values, method)(operand)
+    if isinstance(operand, pd.Series):
+        return getattr(values.astype(object), method)(operand)
+
+    categories = pd.Series(values.cat.categories, dtype=object)
+    matched = getattr(categories, method)(operand).to_numpy(dtype=bool)
+    # code -1 (null) picks the last value, which is how None compares
+    matched = np.append(matched, operator == "!=")
+    return pd.Series(matched[values.cat.codes.to_numpy()], index=values.index)
+
+
+# Conditions are first evaluated in this order, most selective first.
+# Once a plan has been run, the pass rates it has seen are used instead.
+FILTER_SELECTIVITY = {
+    "=": 0.1,
+    "IS NULL": 0.1,
+    "IN": 0.3,
+    ">": 0.5,
+    ">=": 0.5,
+    "<": 0.5,
+    "<=": 0.5,
+    "!=": 0.9,
+    "IS NOT NULL": 0.9,
+}
+
+# Number of compiled filters and filter results to keep
+FILTER_PLAN_CACHE_SIZE = 256
+FILTER_MASK_CACHE_SIZE = 32
+
+_filter_plans = OrderedDict()
+_filter_masks = OrderedDict()
+
+
+class FilterPlan:
     """
-    comparisons = []
+    A compiled filter() definition. Conditions are tested only against
+    rows whose outcome isn't already decided: for "all" matching, rows
+    which passed every condition so far, and for "any" matching, rows
+    which haven't passed one yet.
+    """
+
+    def __init__(self, filters, match_type="all", mode="include"):
+        self.match_type = match_type
+        self.mode = mode
+        self.conditions = []
+
+        for f in filters:
+            column = f["column"]
+            operator = f["operator"]
+            operand = f.get("operand")
+            operand_type = f.get("operand_type", "LITERAL")
+
+            if operand_type != "COLUMN":
+                if operator and operator[0] in ("<", ">"):
+                    # attempt to coerce the operand to a number
+                    try:
+                        operand = float(operand)
+                    except (TypeError, ValueError):
+                        pass
+                if operator == "IN":
+                    operand = list(operand)
+            elif operator == "IN":
+                raise Exception(f"filter operator {operator}")
+
+            if operator not in FILTER_SELECTIVITY:
+                raise Exception(f"filter operator {operator}")
+
+            self.conditions.append(
+                {
+                    "column": column,
+                    "operator": operator,
+                    "operand": operand,
+                    "operand_type": operand_type,
+                    "tested": 0,
+                    "passed": 0,
+                }
+            )
 
-    for f in filters:
-        column = f["column"]
-        operator = f["operator"]
-        operand = f.get("operand")
-        operand_type = f.get("operand_type", "LITERAL")
+        self.columns = sorted(
+            {c["column"] for c in self.conditions}
+            | {c["operand"] for c in self.conditions if c["operand_type"] == "COLUMN"},
+            key=str,
+        )
 
-        if operand_type == "COLUMN":
+    def _test(self, ds, condition, rows):
+        """
+        Evaluates condition against the rows at positions 'rows'
+        (or every row if rows is None) and returns a boolean array
+        """
+        values = ds[condition["column"]]
+        operand = condition["operand"]
+        if condition["operand_type"] == "COLUMN":
             operand = ds[operand]
-        else:
-            if operator and operator[0] in ("<", ">"):
-                # attempt to coerce the operand to a number
-                try:
-                    operand = float(operand)
-                except:
-                    pass
-
-            if operator == "IN":
-                comparisons.append(ds[column].isin(operand))
-                continue
+        if rows is not None:
+            values = values.iloc[rows]
+            if isinstance(operand, pd.Series):
+                operand = operand.iloc[rows]
 
+        operator = condition["operator"]
         if operator == "IS NULL":
-            comparisons.append(ds[column].isnull())
-            continue
+            rc = values.isnull()
+        elif operator == "IS NOT NULL":
+            rc = values.notnull()
+        elif operator == "IN":
+            rc = values.isin(operand)
+        else:
+            rc = _compare(values, operator, operand)
+        # nullable columns compare to NA, which is treated like an object
+        # column's None: not equal to anything
+        rc = rc.to_numpy(dtype=bool, na_value=operator == "!=")
+
+        condition["tested"] += len(rc)
+        condition["passed"] += int(rc.sum())
+        return rc
+
+    def _ordered(self):
+        def pass_rate(condition):
+            if condition["tested"]:
+                return condition["passed"] / condition["tested"]
+            return FILTER_SELECTIVITY[condition["operator"]]
+
+        # for "any" matching, test the conditions most likely to pass first
+        return sorted(
+            self.conditions, key=pass_rate, reverse=self.match_type == "any"
+        )
 
-        if operator == "IS NOT NULL":
-            comparisons.append(ds[column].notnull())
-            continue
+    def mask(self, ds):
+        """
+        Returns a boolean array marking the rows of ds kept by the filter
+        """
+        n = len(ds)
+        match_any = self.match_type == "any"
+        rc = np.full(n, not match_any or not self.conditions)
+
+        for condition in self._ordered():
+            # only test rows whose result isn't decided yet
+            undecided = ~rc if match_any else rc
+            count = int(undecided.sum())
+            if count == 0:
+                break
+            rows = None if count == n else np.flatnonzero(undecided)
 
-        fn = {
-            "=": "eq",
-            "!=": "ne",
-            ">": "gt",
-            ">=": "ge",
-            "<": "lt",
-            "<=": "le",
-        }
-        if operator in fn:
-            func = getattr(ds[column], fn[operator])
-            comparisons.append(func(operand))
-            continue
+            result = self._test(ds, condition, rows)
+            if rows is None:
+                # copied, as pandas may return a read-only view
+                rc = result.copy()
+            else:
+                rc[rows] = result
 
-        raise Exception(f"filter operator {operator}")
+        if self.mode == "exclude":
+            rc = ~rc
+        return rc
 
-    rc = comparisons[0]
-    for comparison in comparisons[1:]:
-        if match_type == "any":
-            rc |= comparison
-        else:
-            rc &= comparison
+    def apply(self, ds):
+        return ds[self.mask(ds)]
+
+
+def _lru_get(cache, key):
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    return None
+
+
+def _lru_put(cache, key, value, size):
+    cache[key] = value
+    while len(cache) > size:
+        cache.popitem(last=False)
+
+
+def _key_operand(value):
+    """
+    json.dumps() default for plan cache keys. Values are tagged with
+    their type, so that e.g. a Timestamp and its text don't share a key.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    return [type(value).__name__, str(value)]
+
+
+def compile_filter(filters, match_type="all", mode="include"):
+    """
+    Returns a FilterPlan for the filter definition, reusing a previously
+    compiled one where possible
+    """
+    key = json.dumps(
+        [filters, match_type, mode], sort_keys=True, default=_key_operand
+    )
+    plan = _lru_get(_filter_plans, key)
+    if plan is None:
+        plan = FilterPlan(filters, match_type=match_type, mode=mode)
+        _lru_put(_filter_plans, key, plan, FILTER_PLAN_CACHE_SIZE)
+    return plan, key
+
+
+def filter(ds, filters, match_type="all", mode="include", cache=False):
+    # filter definition
+    """
+    {
+        "column": "col_name",
+        "operator": "<=",
+        "operand": "op",
+        "operand_type": "COLUMN", # or "LITERAL"
+    }
+
+    The compiled filter is cached. With cache=True, the rows it selects
+    are cached too, keyed by a fingerprint of the columns the filter reads.
+    Fingerprinting costs about as much as a simple comparison, so this pays
+    off for filters with several conditions on text columns that are
+    applied to the same data repeatedly.
+    """
+    plan, key = compile_filter(filters, match_type=match_type, mode=mode)
+
+    if not cache:
+        return plan.apply(ds)
 
-    if mode == "exclude":
-        rc = ~rc
+    fingerprint = _fingerprint(ds[plan.columns])
+    if fingerprint is None:
+        return plan.apply(ds)
 
-    rc = ds[rc]
+    mask_key = (key, fingerprint)
+    mask = _lru_get(_filter_masks, mask_key)
+    if mask is None:
+        mask = plan.mask(ds)
+        _lru_put(_filter_masks, mask_key, mask, FILTER_MASK_CACHE_SIZE)
+
+    rc = ds[mask]
 
     return rc
 
@@ -550,117 +1539,270 @@ def sort(ds, columns):
     return rc
 
 
-def pivot(ds, aggregations):
-    def sort_column(column_values):
-        """
-        Used to sort a list of values based on the order they appeared
-        in the previous step. This is to work around the fact that
-        pivot_table() automatically sorts the output.
-        """
-        sort_keys = []
-        column_name = ds.columns[0]
-        for value in column_values:
-            # Find the original index of this key, and use that as the
-            # sort key.
-            original_index = ds[ds[column_name] == value].index[0]
-            sort_keys.append(original_index)
+# Maps pivot aggregations to the groupby method which computes them
+PIVOT_AGGREGATIONS = {
+    "SUM": "sum",
+    "AVG": "mean",
+    "MAX": "max",
+    "MIN": "min",
+    "COUNT": "count",
+    "MEDIAN": "median",
+    "COUNT_DISTINCT": "nunique",
+}
 
-        return sort_keys
 
-    aggfuncs = {"SUM": np.sum, "AVG": np.average, "MAX": np.max}
+def _pivot_cells(values, cells, n_cells, aggregation):
+    """
+    Aggregates values into a flat array with one entry per pivot cell.
+    'cells' holds the cell number of each value. Cells without any
+    values are NaN.
+    """
+    method = PIVOT_AGGREGATIONS.get(aggregation)
+    if method is None:
+        raise Exception(f"pivot aggregation {aggregation} is not supported")
+
+    agg = values.groupby(cells, sort=False).agg(method)
+
+    if len(agg) == n_cells:
+        rc = np.empty(n_cells, dtype=agg.dtype)
+    elif pd.api.types.is_numeric_dtype(agg):
+        rc = np.full(n_cells, np.nan)
+    else:
+        rc = np.full(n_cells, np.nan, dtype="object")
+    rc[agg.index.values] = agg.values
+    return rc
+
+
+def pivot(ds, aggregations):
+    """
+    Pivots the second column into new columns, with one row per value of
+    the first column. Rows keep the order in which their key first
+    appears and the new columns are sorted.
+
+    With a single aggregation, the third column is aggregated. Otherwise,
+    aggregations[i] is applied to column i + 2 and the new columns are
+    named "<key>:<column>".
+    """
+    ordered_cols = list(ds.columns)
+    index_col = ordered_cols[0]
+    pivot_col = ordered_cols[1]
+
+    # Row keys are numbered in order of first appearance, and
+    # pivoted keys in sorted order.
+    row_codes, row_keys = pd.factorize(_decode(ds[index_col]), sort=False)
+
+    # Rows with a null key in either column are dropped
+    valid = (row_codes >= 0) & ds[pivot_col].notna().values
+    data = ds
+    if not valid.all():
+        data = ds[valid]
+        row_codes = row_codes[valid]
+        used = np.zeros(len(row_keys), dtype=bool)
+        used[row_codes] = True
+        row_codes = (np.cumsum(used) - 1)[row_codes]
+        row_keys = row_keys[used]
+
+    col_codes, col_keys = pd.factorize(_decode(data[pivot_col]), sort=True)
+    n_rows = len(row_keys)
+    n_cols = len(col_keys)
+    cells = row_codes * n_cols + col_codes
+
+    rc = {index_col: row_keys}
 
     if len(aggregations) == 1:
-        rc = ds.pivot_table(
-            index=ds.columns[0],
-            columns=ds.columns[1],
-            values=ds.columns[2],
-            aggfunc=aggfuncs.get(aggregations[0]),
+        values = _pivot_cells(
+            _decode(data[ordered_cols[2]]).reset_index(drop=True),
+            cells,
+            n_rows * n_cols,
+            aggregations[0],
         )
-        rc = rc.fillna(0)
-        rc.reset_index(level=0, inplace=True)
-        rc.columns.name = ""
+        values = values.reshape(n_rows, n_cols)
+        for i, key in enumerate(col_keys):
+            rc[key] = values[:, i]
     else:
-        ordered_cols = list(ds.columns)
-        aggfunc = {}
-
         for i, fn in enumerate(aggregations):
             if len(ordered_cols) <= i + 2:
                 break
             col = ordered_cols[i + 2]
-            aggfunc[col] = aggfuncs.get(fn)
+            values = _pivot_cells(
+                _decode(data[col]).reset_index(drop=True), cells, n_rows * n_cols, fn
+            )
+            values = values.reshape(n_rows, n_cols)
+            for j, key in enumerate(col_keys):
+                if isinstance(key, float) and key.is_integer():
+                    key = int(key)
+                rc[f"{key}:{col}"] = values[:, j]
+
+    rc = pd.DataFrame(rc)
+    rc = rc.fillna(0)
+    rc.columns.name = ""
 
-        rc = ds.pivot_table(index=ordered_cols[0:2], aggfunc=aggfunc)
-        rc = rc.unstack()
-        rc = rc.reindex(
-            columns=rc.columns.reindex(ordered_cols, level=rc.index.nlevels - 1)[0]
-        )
-        cols = []
-        for col in rc.columns.values:
-            key = col[1]
-            if isinstance(key, float) and key.is_integer():
-                key = int(key)
-            cols.append(f"{key}:{col[0]}")
-        rc.columns = cols
-        rc = rc.fillna(0)
-        rc.reset_index(level=0, inplace=True)
-        rc.columns.name = ""
+    return rc
 
-    # Sort values based on original order, rather than re-ordering
-    # which is what pivot_table() does by default.
-    if len(rc):
-        rc.sort_values(ds.columns[0], key=sort_column, inplace=True, ignore_index=True)
 
+# Number of datasets whose join keys are kept factorized
+JOIN_KEY_CACHE_SIZE = 32
+
+_key_indexes = OrderedDict()
+
+
+class KeyIndex:
+    """
+    The factorized join keys of a dataset: the distinct keys in sorted
+    order (nulls first, matching sort()), the key number of each row and
+    the rows grouped by key.
+    """
+
+    def __init__(self, ds, join_on_first_n_columns):
+        keys = ds.iloc[:, :join_on_first_n_columns]
+        codes, nkeys, first = _group_codes(keys, list(keys.columns), na_first=True)
+
+        self.codes = codes
+        self.keys = keys.iloc[first].reset_index(drop=True)
+        self.counts = np.bincount(codes, minlength=nkeys)
+        self.starts = np.cumsum(self.counts) - self.counts
+
+        # Data that's already sorted on the key doesn't need to be reordered
+        self.sorted = bool((codes[1:] >= codes[:-1]).all())
+        if self.sorted:
+            self.order = np.arange(len(codes))
+        else:
+            self.order = np.argsort(codes, kind="stable")
+
+
+def _key_index(ds, join_on_first_n_columns):
+    """
+    Returns the KeyIndex of ds, reusing it if the same keys were
+    joined before
+    """
+    fingerprint = _fingerprint(ds.iloc[:, :join_on_first_n_columns])
+    if fingerprint is None:
+        return KeyIndex(ds, join_on_first_n_columns)
+
+    key = (fingerprint, join_on_first_n_columns)
+    rc = _lru_get(_key_indexes, key)
+    if rc is None:
+        rc = KeyIndex(ds, join_on_first_n_columns)
+        _lru_put(_key_indexes, key, rc, JOIN_KEY_CACHE_SIZE)
     return rc
 
 
 def _join(join_type, datasets, join_on_first_n_columns, sort_after_join=True):
-    rc = datasets[0]
-
-    ordered_cols = rc.columns[:join_on_first_n_columns]
-
-    for i in range(1, len(datasets)):
-        left_data = rc
-        right_data = datasets[i]
-
-        # Rename join columns on right-hand dataset to match left-hand names
-        renamed_columns = {}
-        for col_num in range(0, join_on_first_n_columns):
-            renamed_columns[right_data.columns[col_num]] = left_data.columns[col_num]
-        right_data_renamed = right_data.rename(columns=renamed_columns)
-
-        rc = left_data.merge(
-            right_data_renamed,
-            how=join_type,
-            left_on=list(left_data.columns[:join_on_first_n_columns]),
-            right_on=list(right_data_renamed.columns[:join_on_first_n_columns]),
-            suffixes=(None, ":1"),
-        )
-
-        # reorder columns
-        rc = reorder_columns(rc, ordered_cols)
+    """
+    Joins all the datasets at once on their first n columns. The output is
+    built in key order, which is the order sort() would give, unless this
+    is a left join with sort_after_join=False, which keeps the order of the
+    first dataset.
+    """
+    n = join_on_first_n_columns
+    key_names = list(datasets[0].columns[:n])
+    indexes = [_key_index(ds, n) for ds in datasets]
 
-    if sort_after_join:
-        # sort first n columns
-        columns = []
-        for n in range(join_on_first_n_columns):
-            columns.append({"col_name": rc.columns[n], "direction": 1})
-        rc = sort(rc, columns)
+    # Number the keys of all the datasets together
+    uniques = pd.concat(
+        [ix.keys.set_axis(key_names, axis=1) for ix in indexes], ignore_index=True
+    )
+    global_codes, nkeys, first = _group_codes(uniques, key_names, na_first=True)
+    keys = uniques.iloc[first].reset_index(drop=True)
+
+    counts = []
+    starts = []
+    offset = 0
+    for ix in indexes:
+        to_global = global_codes[offset : offset + len(ix.counts)]
+        offset += len(ix.counts)
+        c = np.zeros(nkeys, dtype="int64")
+        c[to_global] = ix.counts
+        st = np.zeros(nkeys, dtype="int64")
+        st[to_global] = ix.starts
+        counts.append(c)
+        starts.append(st)
+        if ix is indexes[0]:
+            first_to_global = to_global
+
+    # Datasets without a match for a key contribute one row of nulls
+    pad = [join_type == "outer" or (join_type == "left" and i > 0) for i in range(len(datasets))]
+    rows = [None] * len(datasets)
+
+    if join_type == "left" and not sort_after_join:
+        # every row of the first dataset, in order
+        unit_keys = first_to_global[indexes[0].codes]
+        expand = list(range(1, len(datasets)))
+    else:
+        if join_type == "inner":
+            present = np.logical_and.reduce([c > 0 for c in counts])
+        elif join_type == "left":
+            present = counts[0] > 0
+        else:
+            present = np.logical_or.reduce([c > 0 for c in counts])
+        unit_keys = np.flatnonzero(present)
+        expand = list(range(len(datasets)))
+
+    # Each unit produces the product of the matches in each dataset
+    matches = {}
+    sizes = np.ones(len(unit_keys), dtype="int64")
+    for i in expand:
+        m = counts[i]
+        if pad[i]:
+            m = np.maximum(m, 1)
+        matches[i] = m
+        sizes *= m[unit_keys]
+
+    total = int(sizes.sum())
+    units = np.repeat(np.arange(len(unit_keys)), sizes)
+    row_keys = unit_keys[units]
+    within = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    # The last dataset varies fastest, like consecutive pairwise merges
+    for i in reversed(expand):
+        m = matches[i][row_keys]
+        local = within % m
+        within //= m
+        found = counts[i][row_keys] > 0
+        if len(indexes[i].order):
+            pos = np.where(found, starts[i][row_keys] + local, 0)
+            rows[i] = np.where(found, indexes[i].order[pos], -1)
+        else:
+            rows[i] = np.full(total, -1)
+
+    if rows[0] is None:
+        rows[0] = units
+
+    names = list(key_names)
+    values = [keys.iloc[:, j].values.take(row_keys) for j in range(n)]
+
+    for i, ds in enumerate(datasets):
+        for j in range(n, len(ds.columns)):
+            name = ds.columns[j]
+            if name in names:
+                name = f"{name}:1"
+            names.append(name)
+            values.append(
+                pd.api.extensions.take(ds.iloc[:, j].values, rows[i], allow_fill=True)
+            )
 
+    rc = pd.DataFrame(dict(enumerate(values)), index=range(total))
+    rc.columns = names
     return rc
 
 
-def _column_types_match(datasets, first_n_columns):
-    # TODO: handle more than 2 datasets
-    if len(datasets) > 2:
-        return True
+def _logical_dtype(dtype):
+    """
+    Returns the dtype of a column before xforms.dtypes narrowed it
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return dtype.categories.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "iuf" and dtype.itemsize < 8:
+        return np.dtype(np.float64 if dtype.kind == "f" else np.int64)
+    return dtype
+
 
+def _column_types_match(datasets, first_n_columns):
     d1 = datasets[0]
-    d2 = datasets[1]
-    for n in range(first_n_columns):
-        c1 = d1.columns[n]
-        c2 = d2.columns[n]
-        if d1.dtypes[c1] != d2.dtypes[c2]:
-            return False
+    for d2 in datasets[1:]:
+        for n in range(first_n_columns):
+            if _logical_dtype(d1.dtypes.iloc[n]) != _logical_dtype(d2.dtypes.iloc[n]):
+                return False
 
     return True
 
@@ -681,39 +1823,174 @@ def left_join(datasets, join_on_first_n_columns, sort_after_join=True):
     )
 
 
-def wide_table(ds, column_types: dict = None, column_precision: dict = None):
+# Python and d3 format specifiers for each column type, with the default
+# precision. d3 specifiers are used by plotly:
+# https://github.com/d3/d3-format/blob/main/README.md
+# Here is a tool to help test formats:
+# http://bl.ocks.org/zanarmstrong/05c1e95bf7aa16c4768e
+COLUMN_FORMATS = {
+    "percentage": ("{:,.PRECISION%}", ",.PRECISION%", 0),
+    "integer": ("{:,.0f}", ",.0f", 0),
+    "currency": ("${:,.PRECISIONf}", "$,.PRECISIONf", 2),
+    "real": ("{:,.PRECISIONf}", ",.PRECISIONf", 2),
+}
+
+
+@lru_cache(maxsize=None)
+def column_format(col_type, precision=None):
+    """
+    Returns the Python and d3 format specifiers for a column type, or
+    (None, None) for columns which are displayed as they are
+    """
+    if col_type not in COLUMN_FORMATS:
+        return None, None
+    python, d3, default = COLUMN_FORMATS[col_type]
+    precision = str(default if precision is None else precision)
+    return python.replace("PRECISION", precision), d3.replace("PRECISION", precision)
+
+
+def _format_value(fmt, value):
+    try:
+        return fmt(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+# Columns whose sample has at most this share of distinct values are
+# formatted one distinct value at a time, others one cell at a time
+FORMAT_DISTINCT_RATIO = 0.5
+FORMAT_SAMPLE_SIZE = 10000
+
+
+def _format_values(fmt, values):
+    try:
+        return [fmt(v) for v in values]
+    except (TypeError, ValueError):
+        return [_format_value(fmt, v) for v in values]
+
+
+def _repetitive(values):
+    """
+    Estimates from a sample whether values has few enough distinct values
+    to format each of them only once
+    """
+    step = max(len(values) // FORMAT_SAMPLE_SIZE, 1)
+    sample = values.iloc[::step]
+    try:
+        distinct = sample.nunique(dropna=False)
+    except TypeError:
+        # unhashable values
+        return False
+    return distinct <= len(sample) * FORMAT_DISTINCT_RATIO
+
+
+def format_column(values, col_type=None, precision=None):
+    """
+    Formats a column for display as strings, nulls as empty. Columns with
+    many repeated values only format each distinct value once.
+    """
+    spec, _ = column_format(col_type, precision)
+    fmt = spec.format if spec else str
+
+    if not _repetitive(values):
+        null = values.isna().to_numpy(dtype=bool)
+        formatted = np.full(len(values), "", dtype=object)
+        formatted[~null] = _format_values(fmt, values.to_numpy(dtype=object)[~null])
+        return pd.Series(formatted, index=values.index, name=values.name)
+
+    codes, uniques = pd.factorize(values)
+    # code -1 (null) picks the empty string at the end
+    formatted = np.array(_format_values(fmt, uniques) + [""], dtype=object)
+    return pd.Series(formatted[codes], index=values.index, name=values.name)
+
+
+def _table_window(ds, page=None, page_size=None, max_rows=None):
+    """
+    Returns the rows of ds to render, and a caption describing which rows
+    they are, or None if they are all of them. Pages are numbered from 0.
+    """
+    n = len(ds)
+    start, stop = 0, n
+    if page_size:
+        # pages past the end show the last page
+        last = max(n - 1, 0) // page_size
+        start = min(page or 0, last) * page_size
+        stop = min(start + page_size, n)
+    if max_rows is not None:
+        stop = min(stop, start + max_rows)
+
+    if start == 0 and stop == n:
+        return ds, None
+    return ds.iloc[start:stop], f"Rows {start + 1:,}-{stop:,} of {n:,}"
+
+
+def _escape_column(values):
+    """
+    Renders nulls as empty and escapes HTML in strings, one column at a time
+    """
+    nulls = values.isna()
+    if values.dtype != object and not nulls.any():
+        return values
+
+    values = values.astype(object).where(~nulls, "")
+    if pd.api.types.infer_dtype(values) in ("string", "mixed", "mixed-integer"):
+        # non-strings come back as NaN, so they are restored from values
+        escaped = values.str.replace("&", "&amp;", regex=False)
+        escaped = escaped.str.replace("<", "&lt;", regex=False)
+        escaped = escaped.str.replace(">", "&gt;", regex=False)
+        values = escaped.where(escaped.notna(), values)
+    return values
+
+
+def wide_table(
+    ds,
+    column_types: dict = None,
+    column_precision: dict = None,
+    page=None,
+    page_size=None,
+    max_rows=None,
+):
     """
     Used to display a table of data. This is identical to table(), but
     the table isn't quite as aesthetic. This helps if the table is particularly
     wide since Plotly's tables squish the columns too much to be legible.
+
+    Large tables can be shown a page at a time with page and page_size,
+    and max_rows caps the number of rows rendered.
     """
+    from IPython.display import display, HTML
 
-    formatters = {}
-    for col_name in ds.columns:
-        col_type = column_types.get(col_name)
-        precision = column_precision.get(col_name)
-
-        if col_type == "percentage":
-            precision = precision or 0
-            formatters[col_name] = lambda x: f"{{:,.{precision}%}}".format(x)
-        elif col_type == "integer":
-            formatters[col_name] = lambda x: f"{{:,}}".format(x)
-        elif col_type == "currency":
-            precision = precision or 2
-            formatters[col_name] = lambda x: f"${{:,.{precision}f}}".format(x)
-        elif col_type == "real":
-            precision = precision or 2
-            formatters[col_name] = lambda x: f"{{:,.{precision}f}}".format(x)
-        else:
-            formatters[col_name] = lambda x: str(x)
+    column_types = column_types or {}
+    column_precision = column_precision or {}
+    ds, caption = _table_window(ds, page, page_size, max_rows)
+
+    if len(ds.columns):
+        ds = pd.concat(
+            [
+                format_column(
+                    ds.iloc[:, i],
+                    column_types.get(col_name),
+                    column_precision.get(col_name),
+                )
+                for i, col_name in enumerate(ds.columns)
+            ],
+            axis=1,
+        )
 
-    rc = ds.to_html(
-        escape=True, notebook=True, index=False, justify="left", formatters=formatters
-    )
+    rc = ds.to_html(escape=True, notebook=True, index=False, justify="left")
+    if caption:
+        rc = f"<p>{caption}</p>" + rc
     display(HTML(rc))
 
 
-def table(ds, column_types: dict = None, column_precision: dict = None):
+def table(
+    ds,
+    column_types: dict = None,
+    column_precision: dict = None,
+    page=None,
+    page_size=None,
+    max_rows=None,
+):
     """
     Displays a table of data.
 
@@ -728,66 +2005,178 @@ def table(ds, column_types: dict = None, column_precision: dict = None):
 
     column_precision: Precision of each column. Key is the column name and
                         the value is the number of decimal places.
-    """
 
-    # Formatting is done using d3 format specifiers:
-    # https://github.com/d3/d3-format/blob/main/README.md
-    # Here is a tool to help test formats:
-    # http://bl.ocks.org/zanarmstrong/05c1e95bf7aa16c4768e
+    page, page_size: Only render rows page * page_size onwards, page_size
+                     at a time. Pages are numbered from 0.
+
+    max_rows: Maximum number of rows to render.
+    """
+    import plotly.graph_objects as go
 
     column_types = column_types or {}
     column_precision = column_precision or {}
-    formats = []
-
-    for col_name in ds.columns:
-
-        col_type = column_types.get(col_name)
-        precision = column_precision.get(col_name)
-
-        if col_type == "percentage":
-            precision = precision or 0
-            formats.append(f",.{precision}%")
-        elif col_type == "integer":
-            formats.append(",.0f")
-        elif col_type == "currency":
-            precision = precision or 2
-            formats.append(f"$,.{precision}f")
-        elif col_type == "real":
-            precision = precision or 2
-            formats.append(f",.{precision}f")
-        # elif col_type == "date":
-        #    ds[col_name] = pd.to_datetime(ds[col_name], format="%b %d, %Y")
-        #    formats.append(None)
-        else:
-            formats.append(None)
+    formats = [
+        column_format(column_types.get(c), column_precision.get(c))[1]
+        for c in ds.columns
+    ]
 
-    # ensure nulls render as empty
-    ds.fillna("", inplace=True)
+    # only the rows shown are sent to the browser
+    ds, caption = _table_window(ds, page, page_size, max_rows)
 
-    ds = ds.applymap(lambda c: html.escape(c, quote=False) if isinstance(c, str) else c)
+    # ensure nulls render as empty, and escape HTML
+    values = [_escape_column(ds.iloc[:, i]) for i in range(len(ds.columns))]
 
     # TODO: https://dash.plotly.com/datatable/width#horizontal-scroll
     fig = go.Figure(
         data=[
             go.Table(
                 header=dict(values=list(ds.columns), align="left"),
-                cells=dict(
-                    values=[ds[c] for c in ds.columns], format=formats, align="left"
-                ),
+                cells=dict(values=values, format=formats, align="left"),
             )
         ],
     )
     # leave margin for scroll bar
     fig.update_layout(margin=dict(r=25, l=10, t=0, b=0))
+    if caption:
+        fig.update_layout(title=caption, margin=dict(t=40))
 
     fig.show()
 
 
-def line(ds):
+# Charts with more points than this use WebGL traces, which draw much
+# faster than SVG
+WEBGL_THRESHOLD = 100000
+
+# Default number of buckets to downsample to, about a chart's width in pixels
+DOWNSAMPLE_WIDTH = 1000
+
+
+def _chart_x(values):
+    """
+    Returns x values as floats for downsampling. Dates are converted to
+    nanoseconds, and anything else which isn't numeric is spaced evenly.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy().view("int64").astype(float)
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(
+        values
+    ):
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    return np.arange(len(values), dtype=float)
+
+
+def _buckets(y, width):
+    """
+    Splits y into width rows of equal size, padded with NaN
+    """
+    size = -(-len(y) // width)
+    padded = np.full(width * size, np.nan)
+    padded[: len(y)] = y
+    return padded.reshape(width, size), size
+
+
+def _minmax_rows(y, width):
+    """
+    Returns the rows holding the minimum and maximum of each bucket
+    """
+    buckets, size = _buckets(y, width)
+    nulls = np.isnan(buckets)
+    # a bucket of only nulls keeps its first row, so gaps stay visible
+    lowest = np.where(nulls, np.inf, buckets).argmin(axis=1)
+    highest = np.where(nulls, -np.inf, buckets).argmax(axis=1)
+    offsets = np.arange(width) * size
+    return np.concatenate([offsets + lowest, offsets + highest])
+
+
+def _lttb_rows(x, y, width):
+    """
+    Largest-Triangle-Three-Buckets: picks the row from each bucket which
+    makes the largest triangle with the row picked from the previous
+    bucket and the average of the next one.
+    """
+    n = len(y)
+    edges = np.linspace(1, n - 1, width - 1).astype(np.int64)
+    y = np.where(np.isnan(y), 0, y)
+    if np.isnan(x).any():
+        x = np.arange(n, dtype=float)
+
+    rows = [0]
+    for i in range(len(edges) - 1):
+        start, stop = edges[i], edges[i + 1]
+        if start == stop:
+            continue
+        after = slice(stop, edges[i + 2] if i + 2 < len(edges) else n)
+        next_x, next_y = x[after].mean(), y[after].mean()
+        prev_x, prev_y = x[rows[-1]], y[rows[-1]]
+
+        areas = np.abs(
+            (prev_x - next_x) * (y[start:stop] - prev_y)
+            - (prev_x - x[start:stop]) * (next_y - prev_y)
+        )
+        rows.append(start + areas.argmax())
+    rows.append(n - 1)
+    return np.array(rows)
+
+
+def downsample_rows(ds, width=DOWNSAMPLE_WIDTH, method="minmax"):
+    """
+    Reduces a chart dataset to roughly width points per column, keeping
+    the shape of each line. The first column is the x axis, and rows
+    must be sorted by it.
+
+    method: minmax keeps the lowest and highest point of each bucket,
+            which preserves spikes. lttb keeps the most visually
+            significant point of each bucket.
+    """
+    n = len(ds)
+    if n <= 2 * width or len(ds.columns) < 2:
+        return ds
+    if method not in ("minmax", "lttb"):
+        raise Exception(f"Unknown downsampling method {method}")
+
+    x = _chart_x(ds.iloc[:, 0])
+    rows = [np.array([0, n - 1])]
+    for i in range(1, len(ds.columns)):
+        y = pd.to_numeric(ds.iloc[:, i], errors="coerce").to_numpy(
+            dtype=float, na_value=np.nan
+        )
+        if method == "minmax":
+            rows.append(_minmax_rows(y, width))
+        else:
+            rows.append(_lttb_rows(x, y, width))
+
+    # all columns share the rows picked for any of them, so stacked
+    # charts still line up
+    rows = np.unique(np.concatenate(rows))
+    return ds.iloc[rows[rows < n]]
+
+
+def _prepare_chart(ds, downsample, width, webgl):
+    """
+    Downsamples ds if asked to, and decides whether to use WebGL
+    """
+    if downsample:
+        method = "minmax" if downsample is True else downsample
+        ds = downsample_rows(ds, width=width, method=method)
+    if webgl is None:
+        webgl = len(ds) * (len(ds.columns) - 1) > WEBGL_THRESHOLD
+    return ds, webgl
+
+
+def line(ds, downsample=None, width=DOWNSAMPLE_WIDTH, webgl=None):
     """
     Generate a line chart from dataset. Assumes first column
     is the x axis. Any subsequent columns are new datasets.
+
+    downsample: "minmax" or "lttb" to draw about width points per line.
+                See downsample_rows().
+
+    webgl: Draw with WebGL. By default it's used above WEBGL_THRESHOLD points.
     """
+    import plotly.graph_objects as go
+
+    ds, webgl = _prepare_chart(ds, downsample, width, webgl)
+    scatter = go.Scattergl if webgl else go.Scatter
 
     # Does not work consistently with multiple lines
     # fig = px.line(ds, x=ds.columns[0], y=ds.columns[1:])
@@ -797,7 +2186,7 @@ def line(ds):
     fig = go.Figure()
     for col in ds.columns[1:]:
         fig.add_trace(
-            go.Scatter(x=ds[ds.columns[0]], y=ds[col], mode="lines", name=col)
+            scatter(x=ds[ds.columns[0]], y=ds[col], mode="lines", name=col)
         )
 
     fig.update_layout(margin=dict(r=10, l=10, t=0, b=0))
@@ -813,6 +2202,7 @@ def bar(ds, stacked=False, xaxis_type=None):
     stacked: Display bars stacked on top of each other rather than
              side by side
     """
+    import plotly.express as px
 
     barmode = "group"
     if stacked:
@@ -836,6 +2226,7 @@ def pie(ds, max_items=10):
 
     https://plotly.com/python/pie-charts/
     """
+    import plotly.express as px
 
     sorted_data = sort(ds, [{"col_name": ds.columns[1], "direction": -1}])
     if len(sorted_data) > max_items:
@@ -848,13 +2239,20 @@ def pie(ds, max_items=10):
     fig.show()
 
 
-def area(ds):
+def area(ds, downsample=None, width=DOWNSAMPLE_WIDTH):
     """
     Generate a stacked area chart from dataset. Assumes first column
     is the x axis. Any subsequent columns are new datasets.
 
+    downsample: "minmax" or "lttb" to draw about width points per area.
+                See downsample_rows(). WebGL traces can't be stacked, so
+                this is the way to speed up large area charts.
+
     https://plotly.com/python/filled-area-plots/
     """
+    import plotly.graph_objects as go
+
+    ds, _ = _prepare_chart(ds, downsample, width, False)
 
     fig = go.Figure()
     for col in ds.columns[1:]:
@@ -871,12 +2269,25 @@ def area(ds):
     fig.show()
 
 
-def bar_line(ds, last_x_columns_as_lines: int):
+def bar_line(
+    ds,
+    last_x_columns_as_lines: int,
+    downsample=None,
+    width=DOWNSAMPLE_WIDTH,
+    webgl=None,
+):
     """
     Generate a combination bar and line chart. The first
     column is the x axis. The remaining columns are stacked
     bar charts, and the final x columns are line charts.
+
+    downsample, width, webgl: As for line(). WebGL is only used for the lines.
     """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    ds, webgl = _prepare_chart(ds, downsample, width, webgl)
+    scatter = go.Scattergl if webgl else go.Scatter
 
     fig = make_subplots(specs=[[{"secondary_y": True}]])
 
@@ -893,7 +2304,7 @@ def bar_line(ds, last_x_columns_as_lines: int):
 
     for c in range(len(ds.columns) - last_x_columns_as_lines, len(ds.columns)):
         fig.add_trace(
-            go.Scatter(x=ds[ds.columns[0]], y=ds[ds.columns[c]], name=ds.columns[c]),
+            scatter(x=ds[ds.columns[0]], y=ds[ds.columns[c]], name=ds.columns[c]),
             secondary_y=True,
         )
 
@@ -906,12 +2317,100 @@ def funnel(ds):
     Generate a funnel chart. The first column is the y axis.
     The second column is the x axis.
     """
+    import plotly.express as px
 
     fig = px.funnel(ds, x=ds.columns[1], y=ds.columns[0])
     fig.show()
 
 
-def bubble_map(ds, map_type=None):
+def _hex_cells(x, y):
+    """
+    Returns the axial coordinates of the unit hexagons containing each
+    point, rounding in cube coordinates
+    """
+    q = np.sqrt(3) / 3 * x - y / 3
+    r = 2 / 3 * y
+    s = -q - r
+
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq, rr
+
+
+def bin_points(ds, resolution=1.0, cells="grid", aggregation="SUM"):
+    """
+    Aggregates a bubble_map() dataset into cells, so maps of many points
+    stay small. Each cell becomes one point at the centroid of its rows,
+    labelled with its first label.
+
+    resolution: Size of the cells in degrees
+
+    cells: grid for squares or hex for hexagons
+
+    aggregation: How the values (column 4) in a cell are combined, as in
+                 group_by(). Without a value column, rows are counted.
+
+    Rows without coordinates are dropped.
+    """
+    if cells not in ("grid", "hex"):
+        raise Exception(f"Unknown cell type {cells}")
+
+    lat = pd.to_numeric(ds.iloc[:, 1], errors="coerce").to_numpy(
+        dtype=float, na_value=np.nan
+    )
+    lon = pd.to_numeric(ds.iloc[:, 2], errors="coerce").to_numpy(
+        dtype=float, na_value=np.nan
+    )
+    located = ~(np.isnan(lat) | np.isnan(lon))
+    ds, lat, lon = ds[located], lat[located], lon[located]
+
+    if cells == "grid":
+        row, col = np.floor(lat / resolution), np.floor(lon / resolution)
+    else:
+        col, row = _hex_cells(lon / resolution, lat / resolution)
+    codes, ngroups, first = _group_codes(
+        pd.DataFrame({"row": row, "col": col}), ["row", "col"]
+    )
+    groups = _Groups(codes, ngroups)
+    counts = np.bincount(codes, minlength=ngroups)
+
+    if len(ds.columns) >= 4:
+        if aggregation not in GROUP_BY_ACTIONS:
+            raise Exception(f"Unknown aggregation {aggregation}")
+        method, numeric = GROUP_BY_ACTIONS[aggregation]
+        values = ds.iloc[:, 3].reset_index(drop=True)
+        if numeric:
+            values = pd.to_numeric(values, errors="coerce")
+        value = getattr(groups, method)(values)
+        if value is None:
+            # fall back to pandas, as group_by() does
+            value = values.groupby(codes).agg(method).reindex(range(ngroups)).values
+        value_name = ds.columns[3]
+    else:
+        value, value_name = counts, "COUNT"
+
+    labels = pd.Series(ds.iloc[first, 0].astype(str).to_numpy(), dtype=object)
+    more = counts > 1
+    others = pd.Series(counts[more] - 1).astype(str).values
+    labels[more] = labels[more] + " + " + others + " more"
+
+    return pd.DataFrame(
+        {
+            ds.columns[0]: labels.values,
+            ds.columns[1]: np.bincount(codes, weights=lat, minlength=ngroups) / counts,
+            ds.columns[2]: np.bincount(codes, weights=lon, minlength=ngroups) / counts,
+            value_name: value,
+        }
+    )
+
+
+def bubble_map(
+    ds, map_type=None, resolution=None, cells="grid", aggregation="SUM"
+):
     """
     Show a geographical map of data. Assumes the following columns. This is from
     Chartio:
@@ -927,8 +2426,15 @@ def bubble_map(ds, map_type=None):
     column 3 must have values between -180 and 180, and
     column 4 can’t be negative.
 
+    For large datasets, pass a resolution in degrees to plot one bubble
+    per grid or hex cell, sized by the aggregated value. See bin_points().
+
     https://plotly.com/python/bubble-maps/
     """
+    import plotly.express as px
+
+    if resolution:
+        ds = bin_points(ds, resolution, cells=cells, aggregation=aggregation)
 
     # This column is used for the size fo the bubble
     size = None
@@ -954,3 +2460,6 @@ def bubble_map(ds, map_type=None):
 
     fig.update_layout(margin=dict(r=10, l=10, t=0, b=0))
     fig.show()
+
+
+from xforms.pipeline import Pipeline
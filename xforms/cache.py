@@ -0,0 +1,388 @@
+"""
+Opt-in memoization of the transforms. While enabled, the result of every
+public function in xforms is cached, keyed by a hash of the contents of
+its input datasets and its other arguments, so repeating a chain of
+transforms over unchanged data returns the earlier results.
+
+    cache = ResultCache(max_bytes=256 * 2 ** 20, spill_dir="/tmp/xforms")
+    with caching(cache):
+        rc = xforms.group_by(xforms.filter(ds, filters), columns)
+    print(cache.stats())
+
+Results are kept in memory up to max_bytes, evicting the least recently
+used ones first. With a spill_dir, evicted results are written there as
+parquet files (which requires pyarrow) and read back when needed.
+
+Cached results are copies. Transforms which add or replace a column of
+their input in place still do so when their result comes from the
+cache. Calls with arguments which can't be hashed, like the functions
+passed to custom_new, aren't cached.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import xforms
+
+# Functions in xforms which aren't transforms or have side effects
+EXCLUDED = {
+    "adapter",
+    "compile_case",
+    "compile_filter",
+    "sqlite_engine",
+    "column_format",
+    "table",
+    "wide_table",
+    "line",
+    "bar",
+    "single_value",
+    "pie",
+    "area",
+    "bar_line",
+    "funnel",
+    "bubble_map",
+}
+
+# Transforms which write their result columns into their input dataset
+IN_PLACE = {
+    "add",
+    "add_new",
+    "aggregation_new",
+    "case_statement_new",
+    "column_ratio_new",
+    "custom",
+    "custom_new",
+    "datediff_new",
+    "divide",
+    "divide_new",
+    "format",
+    "multiply",
+    "multiply_new",
+    "ratio_of_total_new",
+    "round",
+    "running_total_new",
+    "subtract_new",
+    "total_column_sum_new",
+}
+
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+
+_lock = threading.Lock()
+_originals = {}
+_state = threading.local()
+
+
+class Unhashable(Exception):
+    pass
+
+
+def _token(value):
+    """
+    Returns value as something json can encode, with datasets replaced
+    by a hash of their contents
+    """
+    if isinstance(value, pd.DataFrame):
+        fingerprint = xforms._fingerprint(value)
+        if fingerprint is None:
+            raise Unhashable("dataset can't be hashed")
+        # _fingerprint doesn't include the index, which filter() keeps
+        return {"frame": fingerprint, "index": _index_token(value.index)}
+    if isinstance(value, pd.Series):
+        return {"series": _token(value.to_frame()), "name": str(value.name)}
+    if isinstance(value, dict):
+        # keep the keys' order and types, which json would lose
+        return {"dict": [[_token(k), _token(v)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_token(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, pd.Timestamp):
+        return {"timestamp": value.isoformat()}
+    raise Unhashable(f"can't hash {type(value).__name__}")
+
+
+def _index_token(index):
+    if isinstance(index, pd.RangeIndex):
+        return [index.start, index.stop, index.step]
+    hashed = pd.util.hash_pandas_object(index, index=False).values
+    return hashlib.sha256(hashed).hexdigest()
+
+
+def step_key(name, fn, args, kwargs):
+    """
+    Returns the cache key of calling fn(*args, **kwargs), or None if the
+    arguments can't be hashed. Arguments are matched to fn's parameters,
+    so passing them by position or by name gives the same key.
+    """
+    try:
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+    except TypeError:
+        return None
+    bound.apply_defaults()
+
+    try:
+        token = [name, [[k, _token(v)] for k, v in bound.arguments.items()]]
+        text = json.dumps(token, allow_nan=True)
+    except (Unhashable, TypeError, ValueError):
+        return None
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _nbytes(value):
+    # Series.memory_usage() returns a number, DataFrame's a Series
+    return int(np.sum(value.memory_usage(deep=True)))
+
+
+def _copy(value):
+    return value.copy(deep=True)
+
+
+class ResultCache:
+    """
+    Keeps transform results in memory, least recently used first out,
+    and optionally spills evicted ones to parquet files in spill_dir
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, spill_dir=None, max_spill_bytes=None):
+        if spill_dir is not None:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise Exception("Spilling the result cache to disk requires pyarrow")
+            os.makedirs(spill_dir, exist_ok=True)
+
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.entries = OrderedDict()
+        self.spilled = OrderedDict()
+        self.bytes = 0
+        self.spill_bytes = 0
+        self.counts = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "uncacheable": 0,
+            "evictions": 0,
+            "spills": 0,
+        }
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns a copy of the result stored for key, or None
+        """
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counts["hits"] += 1
+                return _copy(self.entries[key][0])
+            spilled = self.spilled.pop(key, None)
+            if spilled is None:
+                self.counts["misses"] += 1
+                return None
+
+        path, nbytes, series = spilled
+        try:
+            value = pd.read_parquet(path)
+        except Exception:
+            value = None
+        self._remove_file(path, nbytes)
+        if value is None:
+            with self._lock:
+                self.counts["misses"] += 1
+            return None
+
+        if series is not None:
+            value = value.iloc[:, 0].rename(series[0])
+        with self._lock:
+            self.counts["disk_hits"] += 1
+        # move it back into memory as the most recently used result
+        self.put(key, value)
+        return _copy(value)
+
+    def put(self, key, value):
+        """
+        Stores a copy of a DataFrame or Series result
+        """
+        value = _copy(value)
+        nbytes = _nbytes(value)
+        with self._lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, nbytes)
+            self.bytes += nbytes
+
+            evicted = []
+            while self.bytes > self.max_bytes and self.entries:
+                old_key, (old_value, old_nbytes) = self.entries.popitem(last=False)
+                self.bytes -= old_nbytes
+                self.counts["evictions"] += 1
+                evicted.append((old_key, old_value, old_nbytes))
+
+        if self.spill_dir is not None:
+            for old_key, old_value, old_nbytes in evicted:
+                self._spill(old_key, old_value)
+
+    def _spill(self, key, value):
+        series = None
+        if isinstance(value, pd.Series):
+            series = (value.name,)
+            value = value.to_frame(name="values")
+
+        path = os.path.join(self.spill_dir, f"{key}.parquet")
+        try:
+            value.to_parquet(path)
+        except Exception:
+            # not every dataset can be stored as parquet, e.g. mixed
+            # type columns, and those are just dropped
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        nbytes = os.path.getsize(path)
+
+        removed = []
+        with self._lock:
+            self.spilled[key] = (path, nbytes, series)
+            self.spill_bytes += nbytes
+            self.counts["spills"] += 1
+            while (
+                self.max_spill_bytes is not None
+                and self.spill_bytes > self.max_spill_bytes
+                and self.spilled
+            ):
+                _, (old_path, old_nbytes, _) = self.spilled.popitem(last=False)
+                removed.append((old_path, old_nbytes))
+
+        for old_path, old_nbytes in removed:
+            self._remove_file(old_path, old_nbytes)
+
+    def _remove_file(self, path, nbytes):
+        with self._lock:
+            self.spill_bytes -= nbytes
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            spilled = list(self.spilled.values())
+            self.entries.clear()
+            self.spilled.clear()
+            self.bytes = 0
+        for path, nbytes, _ in spilled:
+            self._remove_file(path, nbytes)
+
+    def stats(self):
+        """
+        Returns the hit and miss counts and the size of the cache
+        """
+        with self._lock:
+            rc = dict(self.counts)
+            lookups = rc["hits"] + rc["disk_hits"] + rc["misses"]
+            rc["hit_rate"] = (rc["hits"] + rc["disk_hits"]) / lookups if lookups else 0.0
+            rc["entries"] = len(self.entries)
+            rc["bytes"] = self.bytes
+            rc["spilled_entries"] = len(self.spilled)
+            rc["spilled_bytes"] = self.spill_bytes
+        return rc
+
+
+def _write_back(ds, rc):
+    """
+    Updates ds with the columns of a cached result, as the transform
+    which produced it would have
+    """
+    for col in rc.columns:
+        ds[col] = rc[col]
+    return ds
+
+
+def _memoize(name, fn, cache):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # only cache the outermost call, as the ones it makes are covered
+        if getattr(_state, "active", False):
+            return fn(*args, **kwargs)
+
+        _state.active = True
+        try:
+            key = step_key(name, fn, args, kwargs)
+            if key is None:
+                with cache._lock:
+                    cache.counts["uncacheable"] += 1
+                return fn(*args, **kwargs)
+
+            rc = cache.get(key)
+            if rc is not None:
+                if name in IN_PLACE:
+                    return _write_back(args[0] if args else kwargs["ds"], rc)
+                return rc
+            rc = fn(*args, **kwargs)
+            if isinstance(rc, (pd.DataFrame, pd.Series)):
+                cache.put(key, rc)
+            return rc
+        finally:
+            _state.active = False
+
+    return wrapper
+
+
+def enable(cache):
+    """
+    Starts caching the results of transform calls in cache. Can't be
+    combined with xforms.profiling.
+    """
+    # profiling also replaces the transforms, and the two can't be undone
+    # in any order
+    from xforms import profiling
+
+    with _lock:
+        if _originals:
+            raise Exception("result caching is already enabled")
+        if profiling._originals:
+            raise Exception("result caching can't be enabled while profiling")
+
+        for name, fn in list(vars(xforms).items()):
+            if not inspect.isfunction(fn) or fn.__module__ != "xforms":
+                continue
+            if name in EXCLUDED or name.startswith("_"):
+                continue
+            _originals[name] = fn
+            setattr(xforms, name, _memoize(name, fn, cache))
+
+
+def disable():
+    """
+    Restores the uncached transforms
+    """
+    with _lock:
+        for name, fn in _originals.items():
+            setattr(xforms, name, fn)
+        _originals.clear()
+
+
+@contextmanager
+def caching(cache=None):
+    """
+    Caches transform results within a with block. Yields the cache, a
+    new ResultCache if none was given.
+    """
+    cache = cache or ResultCache()
+    enable(cache)
+    try:
+        yield cache
+    finally:
+        disable()
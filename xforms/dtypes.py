@@ -0,0 +1,125 @@
+"""
+Opt-in optimization of the memory a dataset uses. Integers are stored in
+the smallest type which holds their values, floats as float32 where that
+loses nothing, and repetitive text as categoricals.
+
+    small = optimize(ds, column_types)
+    print(memory_report(ds, small))
+
+The transforms widen narrowed numbers before doing arithmetic and compare
+categoricals by the strings they encode, so they give the same results
+for an optimized dataset as for the original.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Text columns with at most this many distinct values per row are stored
+# as categoricals
+CATEGORY_RATIO = 0.5
+
+# column_types which each optimization is applied to. Columns without a
+# type are optimized based on their dtype alone.
+INTEGER_TYPES = {"integer"}
+REAL_TYPES = {"integer", "real", "currency", "percentage"}
+TEXT_TYPES = {"text"}
+
+
+def _integers(values):
+    """
+    Returns integer values in the smallest signed type holding them
+    """
+    if values.dtype.itemsize == 1:
+        return values
+    return pd.to_numeric(values, downcast="integer")
+
+
+def _floats(values):
+    """
+    Returns float values as float32 if that doesn't change any of them
+    """
+    if values.dtype != np.float64:
+        return values
+    narrow = values.to_numpy().astype(np.float32)
+    if not np.array_equal(narrow, values.to_numpy(), equal_nan=True):
+        return values
+    return pd.Series(narrow, index=values.index, name=values.name)
+
+
+def _categories(values, category_ratio):
+    """
+    Returns text values as a categorical if few enough are distinct
+    """
+    if len(values) == 0:
+        return values
+    if pd.api.types.infer_dtype(values, skipna=True) != "string":
+        return values
+    if values.nunique() > len(values) * category_ratio:
+        return values
+    return values.astype("category")
+
+
+def _is_text(dtype):
+    """
+    Returns whether dtype can hold text: object, or pandas' string dtype,
+    which pandas 3 uses for text by default
+    """
+    return dtype == object or isinstance(dtype, pd.StringDtype)
+
+
+def optimize_column(values, col_type=None, category_ratio=CATEGORY_RATIO):
+    """
+    Returns values stored in the smallest dtype which keeps all of them.
+    Columns which can't be narrowed are returned unchanged.
+    """
+    dtype = values.dtype
+    if _is_text(dtype) and (col_type is None or col_type in TEXT_TYPES):
+        return _categories(values, category_ratio)
+    if not isinstance(dtype, np.dtype):
+        return values
+    if dtype.kind == "i" and (col_type is None or col_type in INTEGER_TYPES):
+        return _integers(values)
+    if dtype.kind == "f" and (col_type is None or col_type in REAL_TYPES):
+        return _floats(values)
+    return values
+
+
+def optimize(ds, column_types=None, category_ratio=CATEGORY_RATIO):
+    """
+    Returns a copy of ds using less memory. column_types restricts which
+    columns are narrowed: integer columns are downcast, integer, real,
+    currency and percentage ones stored as float32 if lossless, and text
+    ones dictionary encoded. Other types, like dates, are left alone.
+    """
+    column_types = column_types or {}
+    columns = [
+        optimize_column(
+            ds.iloc[:, i], column_types.get(ds.columns[i]), category_ratio
+        )
+        for i in range(len(ds.columns))
+    ]
+    if not columns:
+        return ds.copy()
+    rc = pd.concat(columns, axis=1)
+    rc.columns = ds.columns
+    return rc
+
+
+def memory_report(before, after):
+    """
+    Returns the memory used by each column of two versions of a dataset,
+    like the input and output of optimize()
+    """
+    old = before.memory_usage(index=False, deep=True)
+    new = after.memory_usage(index=False, deep=True)
+    rc = pd.DataFrame(
+        {
+            "column": before.columns,
+            "dtype_before": before.dtypes.astype(str).values,
+            "dtype_after": after.dtypes.astype(str).values,
+            "bytes_before": old.values,
+            "bytes_after": new.values,
+        }
+    )
+    rc["bytes_saved"] = rc["bytes_before"] - rc["bytes_after"]
+    return rc
@@ -0,0 +1,133 @@
+"""
+Incremental versions of transforms for append-only data. Each keeps a
+small state, like a running sum, per-group partial aggregates or bucket
+counts, so when rows are appended only the new rows are processed.
+
+    totals = GroupBy({"amount": "SUM"})
+    for rows in appended_rows():
+        rc = totals.add(rows[["region", "amount"]]).result()
+"""
+
+import numpy as np
+
+import xforms
+from xforms.streaming import GroupByAccumulator
+
+
+class RunningTotal:
+    """
+    running_total_new() over appended rows. add() returns the new rows
+    with their running totals, continuing from the rows added before;
+    the totals of earlier rows don't change.
+    """
+
+    def __init__(self, new_col, source):
+        self.new_col = new_col
+        self.source = source
+        self.total = None
+
+    def add(self, rows):
+        values = xforms._widen(rows[self.source])
+        rc = rows
+        if self.total is None:
+            rc[self.new_col] = values.cumsum()
+            self.total = values.sum()
+        else:
+            rc[self.new_col] = values.cumsum() + self.total
+            self.total = self.total + values.sum()
+        return rc
+
+
+class Aggregation:
+    """
+    aggregation_new() over appended rows. Only the total is kept, so
+    result() fills it in without summing the data again.
+    """
+
+    def __init__(self, new_col, source, operation="sum"):
+        if operation != "sum":
+            raise Exception(f"Aggregating with {operation} is not supported")
+        self.new_col = new_col
+        self.source = source
+        self.total = 0
+
+    def add(self, rows):
+        self.total = self.total + xforms._widen(rows[self.source]).sum()
+        return self
+
+    def result(self, ds):
+        rc = ds
+        rc[self.new_col] = self.total
+        return rc
+
+
+class RatioOfTotal:
+    """
+    ratio_of_total_new() over appended rows. Only the total is kept, so
+    result() divides by it without summing the data again. Ratios
+    computed before the last add() are brought up to date by multiplying
+    them by rescale.
+    """
+
+    def __init__(self, new_col, source):
+        self.new_col = new_col
+        self.source = source
+        self.total = 0
+        self.rescale = 1.0
+
+    def add(self, rows):
+        total = self.total + xforms._widen(rows[self.source]).sum()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.rescale = np.float64(self.total) / total
+        self.total = total
+        return self
+
+    def result(self, ds):
+        """
+        Adds the ratios of ds's rows, which can be all the rows added so
+        far or just some of them, like the latest ones
+        """
+        rc = ds
+        rc[self.new_col] = xforms._widen(ds[self.source]) / self.total
+        return rc
+
+
+class GroupBy:
+    """
+    group_by() over appended rows. The partial aggregates are combined
+    as rows are added, so the state grows with the number of groups
+    rather than rows. The exceptions are COUNT_DISTINCT, which keeps the
+    distinct values of each group, and MEDIAN, which keeps every value.
+    """
+
+    def __init__(self, columns):
+        self.accumulator = GroupByAccumulator(columns)
+
+    def add(self, rows):
+        self.accumulator.add(rows).compact()
+        return self
+
+    def result(self):
+        return self.accumulator.result()
+
+
+class Histogram:
+    """
+    histogram_buckets() over appended rows, keeping only the bucket
+    counts and the maximum value
+    """
+
+    def __init__(self, col, aggregation, bucket_type, custom_buckets):
+        if aggregation != "COUNT":
+            raise Exception("We only support COUNT aggregations in histograms")
+        if bucket_type != "custom_buckets":
+            raise Exception("We only support custom_buckets in histograms")
+        self.col = col
+        self.accumulator = xforms.HistogramAccumulator(custom_buckets)
+
+    def add(self, rows):
+        self.accumulator.add(rows[self.col])
+        return self
+
+    def result(self):
+        return self.accumulator.result()
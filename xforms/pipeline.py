@@ -0,0 +1,308 @@
+import inspect
+import operator
+
+import xforms
+
+
+# Arithmetic steps that can be fused together. Each entry maps the step
+# name to the operator it applies.
+_ARITHMETIC = {
+    "add_new": operator.add,
+    "subtract_new": operator.sub,
+    "multiply_new": operator.mul,
+    "divide_new": operator.truediv,
+    "column_ratio_new": operator.truediv,
+    "add": operator.add,
+    "multiply": operator.mul,
+    "divide": operator.truediv,
+}
+
+# Steps that compute each output row only from the same input row. A filter
+# can be moved ahead of these as long as it doesn't read what they write.
+_ROW_LOCAL = set(_ARITHMETIC) | {
+    "round",
+    "substr",
+    "substr_new",
+    "datediff_new",
+    "case_statement_new",
+    "custom_new",
+    "custom",
+}
+
+
+class Step:
+    def __init__(self, name, args, kwargs):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f"{self.name}{self.args}"
+
+    def row_local(self):
+        """
+        Returns whether each output row only depends on the same input row
+        """
+        if self.name in ("custom_new", "custom"):
+            # in batch mode the function sees whole chunks of rows
+            mode = self.args[2] if len(self.args) > 2 else self.kwargs.get("mode")
+            return mode in (None, "row")
+        return self.name in _ROW_LOCAL
+
+    def operands(self):
+        """
+        Returns (new_col, left, right) for an arithmetic step
+        """
+        if self.name in ("add", "multiply", "divide"):
+            col, other = self.args[:2]
+            return col, col, other
+        return self.args[:3]
+
+    def reads(self):
+        """
+        Returns the set of columns read by this step, or None if
+        the step may read any column.
+        """
+        name = self.name
+        args = self.args
+
+        if name in _ARITHMETIC:
+            _, left, right = self.operands()
+            return {c for c in (left, right) if isinstance(c, str)}
+        if name in ("round", "substr"):
+            return {args[0]}
+        if name == "substr_new":
+            return {args[1]}
+        if name == "datediff_new":
+            return {args[1], args[2]}
+        if name == "case_statement_new":
+            source, conditions, default = args[1:4]
+            default_type = args[4] if len(args) > 4 else "LITERAL"
+            default_type = self.kwargs.get("default_type", default_type)
+            cols = {source}
+            if default_type == "COLUMN":
+                cols.add(default)
+            for c in conditions:
+                if c["value_type"] == "COLUMN":
+                    cols.add(c["value"])
+            return cols
+        if name == "sort":
+            return {c["col_name"] for c in args[0]}
+        if name == "reorder_columns":
+            return set()
+        if name == "filter":
+            cols = set()
+            for f in args[0]:
+                cols.add(f["column"])
+                if f.get("operand_type", "LITERAL") == "COLUMN":
+                    cols.add(f["operand"])
+            return cols
+        return None
+
+    def writes(self):
+        """
+        Returns the column written by this step, or None
+        """
+        if self.name in _ARITHMETIC:
+            return self.operands()[0]
+        if self.row_local():
+            return self.args[0]
+        return None
+
+
+class FusedArithmetic:
+    """
+    A run of consecutive arithmetic steps evaluated together. Intermediate
+    results are kept as Series and each output column is written to the
+    dataset once at the end.
+    """
+
+    name = "fused_arithmetic"
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __repr__(self):
+        return f"{self.name}{self.steps}"
+
+    def run(self, ds):
+        env = {}
+
+        def column(name):
+            if name in env:
+                return env[name]
+            return xforms._widen(ds[name])
+
+        def has_column(name):
+            return name in env or name in ds.columns
+
+        for step in self.steps:
+            new_col, left, right = step.operands()
+            fn = _ARITHMETIC[step.name]
+
+            if fn is operator.truediv:
+                if has_column(left) and has_column(right):
+                    env[new_col] = column(left) / column(right)
+                else:
+                    env[new_col] = xforms.pd.Series(dtype="float", index=ds.index)
+            elif fn is operator.mul:
+                if isinstance(left, str):
+                    left = column(left)
+                if isinstance(right, str):
+                    right = column(right)
+                env[new_col] = left * right
+            else:
+                env[new_col] = fn(column(left), column(right))
+
+        rc = ds
+        for name, values in env.items():
+            rc[name] = values
+        return rc
+
+
+class Pipeline:
+    """
+    Records transform steps lazily and runs them with a few optimizations:
+
+        - derived columns which are later dropped by remove_columns
+          are never computed
+        - filters are moved ahead of row-wise derivations they
+          don't depend on
+        - consecutive arithmetic steps are evaluated together
+
+    Steps are recorded by calling the transform by name, without the
+    dataset argument:
+
+        p = Pipeline().add_new("c", "a", "b").filter(filters)
+        rc = p.run(ds)
+    """
+
+    def __init__(self, steps=None):
+        self.steps = list(steps or [])
+
+    def __getattr__(self, name):
+        fn = getattr(xforms, name, None)
+        if name.startswith("_") or not callable(fn):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            # arguments passed by name are moved to their positions, so
+            # steps can find them the same way however they were passed
+            bound = inspect.signature(fn).bind(None, *args, **kwargs)
+            self.steps.append(Step(name, bound.args[1:], bound.kwargs))
+            return self
+
+        return record
+
+    def plan(self):
+        steps = _eliminate_dead_columns(self.steps)
+        steps = _push_down_filters(steps)
+        return _fuse_arithmetic(steps)
+
+    def explain(self):
+        return [repr(step) for step in self.plan()]
+
+    def stream(self, chunks):
+        """
+        Runs the pipeline over an iterable of DataFrame chunks, yielding
+        each processed chunk. Every step must work on chunks independently,
+        except running_total_new which is carried across chunks.
+        """
+        from xforms import streaming
+
+        streamed, blocking, _ = streaming._split(self.plan())
+        if blocking is not None:
+            raise Exception(f"{blocking.name} can't be streamed, use run_chunks()")
+        return streaming.stream(streamed, chunks)
+
+    def run_chunks(self, chunks):
+        """
+        Runs the pipeline over an iterable of DataFrame chunks and returns
+        the result. A group_by or histogram_buckets step is computed from
+        partial results of each chunk.
+        """
+        from xforms import streaming
+
+        return streaming.run_chunks(self.plan(), chunks)
+
+    def run(self, ds):
+        rc = ds
+        for step in self.plan():
+            if isinstance(step, FusedArithmetic):
+                rc = step.run(rc)
+            else:
+                fn = getattr(xforms, step.name)
+                rc = fn(rc, *step.args, **step.kwargs)
+        return rc
+
+
+def _eliminate_dead_columns(steps):
+    # Walk the steps backwards tracking columns whose current value
+    # is never observed downstream.
+    dead = set()
+    kept = []
+
+    for step in reversed(steps):
+        if step.name == "remove_columns":
+            dead |= set(step.args[0])
+            kept.append(step)
+            continue
+
+        reads = step.reads()
+        writes = step.writes()
+
+        if writes is not None and writes in dead:
+            continue
+
+        if reads is None:
+            # The step may observe any column
+            dead = set()
+            kept.append(step)
+            continue
+
+        dead -= reads
+        if writes is not None and writes not in reads:
+            dead.add(writes)
+        kept.append(step)
+
+    kept.reverse()
+    return kept
+
+
+def _push_down_filters(steps):
+    rc = []
+    for step in steps:
+        if step.name != "filter":
+            rc.append(step)
+            continue
+
+        reads = step.reads()
+        i = len(rc)
+        while i > 0:
+            prev = rc[i - 1]
+            if not prev.row_local() or prev.writes() in reads:
+                break
+            i -= 1
+        rc.insert(i, step)
+    return rc
+
+
+def _fuse_arithmetic(steps):
+    rc = []
+    run = []
+
+    def flush():
+        if len(run) > 1:
+            rc.append(FusedArithmetic(list(run)))
+        else:
+            rc.extend(run)
+        run.clear()
+
+    for step in steps:
+        if step.name in _ARITHMETIC:
+            run.append(step)
+        else:
+            flush()
+            rc.append(step)
+    flush()
+    return rc
@@ -0,0 +1,244 @@
+"""
+Opt-in instrumentation of the transforms. While enabled, every public
+function in xforms records its wall time, rows and columns in and out
+and, optionally, memory allocated, and sends the record to a sink.
+
+    sink = MemorySink()
+    with profile(sink):
+        rc = xforms.group_by(xforms.filter(ds, filters), columns)
+    print(sink.summary())
+
+Instrumentation works by replacing the functions in the xforms module,
+so there is no overhead at all while it's disabled. Functions imported
+directly (from xforms import filter) before enabling aren't instrumented.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+import xforms
+
+# Functions in xforms that aren't transforms
+EXCLUDED = {"adapter", "compile_filter", "sqlite_engine"}
+
+_lock = threading.Lock()
+_originals = {}
+_state = threading.local()
+
+
+class MemorySink:
+    """
+    Keeps records in memory
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def summary(self, top=None):
+        return summary(self.records, top=top)
+
+
+class JsonLinesSink:
+    """
+    Appends each record to a file as a line of JSON
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class LoggingSink:
+    """
+    Logs each record
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("xforms.profiling")
+        self.level = level
+
+    def emit(self, record):
+        self.logger.log(
+            self.level,
+            "%s%s: %.1fms, %s -> %s rows",
+            "  " * record["depth"],
+            record["step"],
+            record["seconds"] * 1000,
+            record["rows_in"],
+            record["rows_out"],
+            extra={"xforms_step": record},
+        )
+
+
+def _shape(value):
+    """
+    Returns the (rows, columns) of a dataset or list of datasets
+    """
+    if isinstance(value, pd.DataFrame):
+        return len(value), len(value.columns)
+    if isinstance(value, (list, tuple)) and value and all(
+        isinstance(v, pd.DataFrame) for v in value
+    ):
+        return sum(len(v) for v in value), sum(len(v.columns) for v in value)
+    return None, None
+
+
+def _input_shape(args, kwargs):
+    """
+    Returns the shape of the first dataset among a call's arguments, like
+    the datasets _join() takes after the join type
+    """
+    for value in list(args) + list(kwargs.values()):
+        shape = _shape(value)
+        if shape != (None, None):
+            return shape
+    return None, None
+
+
+def _instrument(name, fn, sink, memory):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_state, "stack", None)
+        if stack is None:
+            stack = _state.stack = []
+
+        rows_in, columns_in = _input_shape(args, kwargs)
+        frame = {"peak": 0}
+        if memory:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            rc = fn(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+
+        record = {
+            "step": name,
+            "depth": len(stack),
+            "seconds": seconds,
+            "rows_in": rows_in,
+            "rows_out": None,
+            "columns_in": columns_in,
+            "columns_out": None,
+        }
+        record["rows_out"], record["columns_out"] = _shape(rc)
+
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # nested calls reset the peak, so include the highest they saw
+            peak = max(peak, frame["peak"])
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            record["bytes_allocated"] = current - start_memory
+            record["peak_bytes"] = peak - start_memory
+
+        sink.emit(record)
+        return rc
+
+    return wrapper
+
+
+def enable(sink, memory=False):
+    """
+    Starts sending a record for every transform call to sink. With
+    memory=True, allocations are traced with tracemalloc, which makes
+    the transforms noticeably slower. Can't be combined with xforms.cache.
+    """
+    # result caching also replaces the transforms, and the two can't be
+    # undone in any order
+    from xforms import cache
+
+    with _lock:
+        if _originals:
+            raise Exception("profiling is already enabled")
+        if cache._originals:
+            raise Exception("profiling can't be enabled while caching results")
+
+        for name, fn in list(vars(xforms).items()):
+            if not inspect.isfunction(fn) or fn.__module__ != "xforms":
+                continue
+            if name in EXCLUDED or (name.startswith("_") and name != "_join"):
+                continue
+            _originals[name] = fn
+            setattr(xforms, name, _instrument(name, fn, sink, memory))
+
+        _state.tracing = memory and not tracemalloc.is_tracing()
+        if _state.tracing:
+            tracemalloc.start()
+
+
+def disable():
+    """
+    Restores the uninstrumented transforms
+    """
+    with _lock:
+        for name, fn in _originals.items():
+            setattr(xforms, name, fn)
+        _originals.clear()
+
+        if getattr(_state, "tracing", False):
+            tracemalloc.stop()
+            _state.tracing = False
+
+
+@contextmanager
+def profile(sink=None, memory=False):
+    """
+    Instruments the transforms within a with block. Yields the sink,
+    a new MemorySink if none was given.
+    """
+    sink = sink or MemorySink()
+    enable(sink, memory=memory)
+    try:
+        yield sink
+    finally:
+        disable()
+
+
+def summary(records, top=None):
+    """
+    Summarizes records by step, slowest total time first. Times of
+    nested calls are also included in the calls they were made from.
+    """
+    if not records:
+        return pd.DataFrame(
+            columns=["step", "calls", "total_seconds", "mean_seconds", "max_seconds"]
+        )
+
+    data = pd.DataFrame(records)
+    agg = {
+        "calls": ("seconds", "size"),
+        "total_seconds": ("seconds", "sum"),
+        "mean_seconds": ("seconds", "mean"),
+        "max_seconds": ("seconds", "max"),
+        "rows_in": ("rows_in", "sum"),
+        "rows_out": ("rows_out", "sum"),
+    }
+    if "peak_bytes" in data.columns:
+        agg["max_peak_bytes"] = ("peak_bytes", "max")
+        agg["bytes_allocated"] = ("bytes_allocated", "sum")
+
+    rc = data.groupby("step").agg(**agg).reset_index()
+    rc = rc.sort_values("total_seconds", ascending=False, ignore_index=True)
+    if top:
+        rc = rc.head(top)
+    return rc
@@ -0,0 +1,775 @@
+"""
+Compiles simple sqlite scalar expressions, like the ones passed to
+sqlite_new(), into vectorized pandas operations.
+
+Only expressions whose result is known to match sqlite are compiled.
+Anything else raises UnsupportedExpression so the caller can fall back
+to running the query in sqlite.
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+class UnsupportedExpression(Exception):
+    pass
+
+
+_TOKEN = re.compile(
+    r"""
+    \s*(?:
+        (?P<number>\d+\.\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?|\d+(?:[eE][-+]?\d+)?)
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op>\|\||<>|!=|==|<=|>=|[-+*/%(),<>=])
+    )""",
+    re.VERBOSE,
+)
+
+_KEYWORDS = {
+    "AND", "OR", "NOT", "IS", "NULL", "IN", "LIKE", "BETWEEN",
+    "CASE", "WHEN", "THEN", "ELSE", "END",
+}
+
+
+def _tokenize(query):
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        m = _TOKEN.match(query, pos)
+        if not m or m.end() == pos:
+            raise UnsupportedExpression(f"unexpected input at {query[pos:]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind == "number":
+            value = float(text) if any(c in text for c in ".eE") else int(text)
+            tokens.append(("literal", value))
+        elif kind == "string":
+            tokens.append(("literal", text[1:-1].replace("''", "'")))
+        elif kind == "quoted":
+            if text[0] == "[":
+                tokens.append(("column", text[1:-1]))
+            else:
+                tokens.append(("column", text[1:-1].replace(text[0] * 2, text[0])))
+        elif kind == "name":
+            upper = text.upper()
+            if upper in _KEYWORDS:
+                tokens.append(("keyword", upper))
+            else:
+                tokens.append(("name", text))
+        else:
+            tokens.append(("op", text))
+    tokens.append(("end", None))
+    return tokens
+
+
+# Binding powers, following sqlite's operator precedence
+_BINARY = {
+    "OR": 1,
+    "AND": 2,
+    "=": 4, "==": 4, "!=": 4, "<>": 4, "IS": 4, "IN": 4, "LIKE": 4,
+    "BETWEEN": 4, "NOT": 4,
+    "<": 5, "<=": 5, ">": 5, ">=": 5,
+    "+": 7, "-": 7,
+    "*": 8, "/": 8, "%": 8,
+    "||": 9,
+}
+
+
+class _Parser:
+    """
+    Pratt parser producing a tree of tuples: (node type, ...)
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def accept(self, kind, value):
+        if self.peek() == (kind, value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind, value):
+        if not self.accept(kind, value):
+            raise UnsupportedExpression(f"expected {value} but found {self.peek()[1]}")
+
+    def parse(self):
+        rc = self.expression(0)
+        if self.peek()[0] != "end":
+            raise UnsupportedExpression(f"unexpected {self.peek()[1]}")
+        return rc
+
+    def expression(self, min_power):
+        left = self.prefix()
+        while True:
+            kind, value = self.peek()
+            if kind not in ("op", "keyword") or value not in _BINARY:
+                break
+            power = _BINARY[value]
+            if power <= min_power:
+                break
+            self.next()
+            left = self.infix(value, left, power)
+        return left
+
+    def prefix(self):
+        kind, value = self.next()
+
+        if kind == "literal":
+            return ("literal", value)
+        if kind == "column":
+            return ("column", value)
+        if kind == "keyword" and value == "NULL":
+            return ("literal", None)
+        if kind == "keyword" and value == "NOT":
+            return ("not", self.expression(3))
+        if kind == "keyword" and value == "CASE":
+            return self.case()
+        if kind == "op" and value == "(":
+            rc = self.expression(0)
+            self.expect("op", ")")
+            return rc
+        if kind == "op" and value in ("-", "+"):
+            operand = self.expression(10)
+            if value == "+":
+                return operand
+            return ("negate", operand)
+        if kind == "name":
+            if self.accept("op", "("):
+                args = []
+                if not self.accept("op", ")"):
+                    args.append(self.expression(0))
+                    while self.accept("op", ","):
+                        args.append(self.expression(0))
+                    self.expect("op", ")")
+                return ("function", value.upper(), args)
+            return ("column", value)
+
+        raise UnsupportedExpression(f"unexpected {value}")
+
+    def infix(self, op, left, power):
+        if op == "IS":
+            negate = self.accept("keyword", "NOT")
+            self.expect("keyword", "NULL")
+            return ("isnull", left, negate)
+
+        if op == "NOT":
+            # x NOT IN (...), x NOT LIKE y, x NOT BETWEEN a AND b
+            kind, value = self.next()
+            if value not in ("IN", "LIKE", "BETWEEN"):
+                raise UnsupportedExpression(f"unexpected NOT {value}")
+            return ("not", self.infix(value, left, power))
+
+        if op == "IN":
+            self.expect("op", "(")
+            items = [self.expression(0)]
+            while self.accept("op", ","):
+                items.append(self.expression(0))
+            self.expect("op", ")")
+            return ("in", left, items)
+
+        if op == "BETWEEN":
+            low = self.expression(power)
+            self.expect("keyword", "AND")
+            high = self.expression(power)
+            return ("between", left, low, high)
+
+        if op == "LIKE":
+            return ("like", left, self.expression(power))
+
+        return ("binary", op, left, self.expression(power))
+
+    def case(self):
+        base = None
+        if self.peek() != ("keyword", "WHEN"):
+            base = self.expression(0)
+
+        branches = []
+        while self.accept("keyword", "WHEN"):
+            condition = self.expression(0)
+            if base is not None:
+                condition = ("binary", "=", base, condition)
+            self.expect("keyword", "THEN")
+            branches.append((condition, self.expression(0)))
+
+        if not branches:
+            raise UnsupportedExpression("CASE without WHEN")
+
+        default = ("literal", None)
+        if self.accept("keyword", "ELSE"):
+            default = self.expression(0)
+        self.expect("keyword", "END")
+        return ("case", branches, default)
+
+
+@lru_cache(maxsize=256)
+def parse(query):
+    """
+    Parses a sqlite expression, raising UnsupportedExpression if
+    it uses syntax we don't handle
+    """
+    return _Parser(_tokenize(query)).parse()
+
+
+def like_regex(pattern):
+    """
+    Converts a sql LIKE pattern into a regular expression
+    """
+    return "".join(
+        ".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern
+    )
+
+
+class _Evaluator:
+    """
+    Evaluates a parsed expression against a dataset. Values are either
+    python scalars or Series aligned with the dataset.
+    """
+
+    def __init__(self, ds):
+        self.ds = ds
+        self.columns = {}
+
+    def column(self, name):
+        if name in self.columns:
+            return self.columns[name]
+
+        ds = self.ds
+        if name not in ds.columns:
+            # sqlite column names are case insensitive
+            matches = [c for c in ds.columns if str(c).lower() == name.lower()]
+            if len(matches) != 1:
+                raise UnsupportedExpression(f"unknown column {name}")
+            name = matches[0]
+
+        values = ds[name]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            # sqlite sees dates as text
+            text = values.dt.strftime("%Y-%m-%d %H:%M:%S")
+            values = text.where(values.notnull(), None)
+        elif pd.api.types.is_bool_dtype(values):
+            values = values.astype("int64")
+        elif isinstance(values.dtype, (pd.StringDtype, pd.CategoricalDtype)):
+            # evaluate as read_sql would return it, with None for nulls
+            values = values.astype(object).where(values.notnull(), None)
+        elif isinstance(values.dtype, np.dtype) and values.dtype.itemsize < 8:
+            # sqlite's numbers are 64 bit
+            if values.dtype.kind in "iu":
+                values = values.astype(np.int64)
+            elif values.dtype.kind == "f":
+                values = values.astype(np.float64)
+        elif not pd.api.types.is_numeric_dtype(values):
+            if _kind(values) != "text":
+                raise UnsupportedExpression(f"column {name} has mixed types")
+
+        self.columns[name] = values
+        return values
+
+    def evaluate(self, node):
+        return getattr(self, "eval_" + node[0])(*node[1:])
+
+    def eval_literal(self, value):
+        return value
+
+    def eval_column(self, name):
+        return self.column(name)
+
+    def eval_negate(self, operand):
+        value = self.evaluate(operand)
+        _require(value, "num")
+        if value is None:
+            return None
+        return -value
+
+    def eval_not(self, operand):
+        value = _truth(self.evaluate(operand))
+        if value is None:
+            return None
+        return ~value
+
+    def eval_isnull(self, operand, negate):
+        value = self.evaluate(operand)
+        if isinstance(value, pd.Series):
+            rc = value.isnull()
+        else:
+            rc = pd.Series(value is None, index=self.ds.index)
+        if negate:
+            rc = ~rc
+        return rc.astype("boolean")
+
+    def eval_binary(self, op, left, right):
+        left = self.evaluate(left)
+        right = self.evaluate(right)
+
+        if op in ("AND", "OR"):
+            left = _truth(left, self.ds.index)
+            right = _truth(right, self.ds.index)
+            return left & right if op == "AND" else left | right
+
+        if op == "||":
+            return _concat(left, right)
+
+        if op in ("+", "-", "*", "/", "%"):
+            return _arithmetic(op, left, right)
+
+        return _compare(op, left, right, self.ds.index)
+
+    def eval_in(self, operand, items):
+        value = self.evaluate(operand)
+        items = [self.evaluate(i) for i in items]
+        if any(isinstance(i, pd.Series) for i in items) or None in items:
+            raise UnsupportedExpression("IN only supports literal values")
+
+        kind = _kind(value)
+        for i in items:
+            if kind != "null" and _kind(i) != kind:
+                raise UnsupportedExpression("IN with mixed types")
+
+        if not isinstance(value, pd.Series):
+            value = pd.Series(value, index=self.ds.index, dtype="object")
+        rc = value.isin(items).astype("boolean")
+        rc[value.isnull()] = pd.NA
+        return rc
+
+    def eval_between(self, operand, low, high):
+        value = self.evaluate(operand)
+        index = self.ds.index
+        return _compare(">=", value, self.evaluate(low), index) & _compare(
+            "<=", value, self.evaluate(high), index
+        )
+
+    def eval_like(self, operand, pattern):
+        value = self.evaluate(operand)
+        pattern = self.evaluate(pattern)
+        if not isinstance(pattern, str) or _kind(value) not in ("text", "null"):
+            raise UnsupportedExpression("LIKE only supports literal text patterns")
+        if not isinstance(value, pd.Series):
+            value = pd.Series(value, index=self.ds.index, dtype="object")
+        # sqlite's LIKE is case insensitive for ASCII characters
+        rc = value.str.fullmatch(like_regex(pattern), case=False, flags=re.DOTALL)
+        return rc.astype("boolean")
+
+    def eval_case(self, branches, default):
+        index = self.ds.index
+        conditions = []
+        values = []
+        for condition, value in branches:
+            conditions.append(_truth(self.evaluate(condition), index).fillna(False))
+            values.append(self.evaluate(value))
+        values.append(self.evaluate(default))
+
+        kinds = {_kind(v) for v in values} - {"null"}
+        if len(kinds) > 1:
+            raise UnsupportedExpression("CASE with mixed result types")
+
+        arrays = [_array(v, index, kinds) for v in values]
+        rc = np.select(
+            [c.to_numpy(dtype=bool) for c in conditions], arrays[:-1], arrays[-1]
+        )
+        return pd.Series(rc, index=index)
+
+    def eval_function(self, name, args):
+        fn = getattr(self, "fn_" + name.lower(), None)
+        if fn is None:
+            raise UnsupportedExpression(f"unsupported function {name}")
+        return fn(*[self.evaluate(a) for a in args])
+
+    def fn_coalesce(self, *args):
+        if len(args) < 2:
+            raise UnsupportedExpression("COALESCE needs at least two arguments")
+        kinds = {_kind(a) for a in args} - {"null"}
+        if len(kinds) > 1:
+            raise UnsupportedExpression("COALESCE with mixed types")
+
+        rc = args[0]
+        for arg in args[1:]:
+            if not isinstance(rc, pd.Series):
+                return rc if rc is not None else arg
+            if isinstance(arg, pd.Series):
+                rc = rc.where(rc.notnull(), arg)
+            elif arg is not None:
+                rc = rc.fillna(arg)
+        return rc
+
+    def fn_ifnull(self, *args):
+        if len(args) != 2:
+            raise UnsupportedExpression("IFNULL takes two arguments")
+        return self.fn_coalesce(*args)
+
+    def fn_nullif(self, value, other):
+        equal = _compare("=", value, other, self.ds.index).fillna(False)
+        if not isinstance(value, pd.Series):
+            value = pd.Series(value, index=self.ds.index)
+        return value.where(~equal.astype(bool), None)
+
+    def fn_substr(self, value, start, length=None):
+        value = _text(value, self.ds.index)
+        if not isinstance(start, int) or start < 1:
+            raise UnsupportedExpression("SUBSTR needs a positive literal start")
+        if length is not None and (not isinstance(length, int) or length < 0):
+            raise UnsupportedExpression("SUBSTR needs a non-negative literal length")
+        end = None if length is None else start - 1 + length
+        return value.str[start - 1 : end]
+
+    fn_substring = fn_substr
+
+    def fn_upper(self, value):
+        return _text(value, self.ds.index).str.upper()
+
+    def fn_lower(self, value):
+        return _text(value, self.ds.index).str.lower()
+
+    def fn_trim(self, value):
+        return _text(value, self.ds.index).str.strip(" ")
+
+    def fn_ltrim(self, value):
+        return _text(value, self.ds.index).str.lstrip(" ")
+
+    def fn_rtrim(self, value):
+        return _text(value, self.ds.index).str.rstrip(" ")
+
+    def fn_length(self, value):
+        return _text(value, self.ds.index).str.len()
+
+    def fn_abs(self, value):
+        _require(value, "num")
+        return None if value is None else abs(value)
+
+    def fn_round(self, value, places=0):
+        _require(value, "num")
+        if not isinstance(places, int):
+            raise UnsupportedExpression("ROUND needs literal places")
+        if value is None:
+            return None
+        # sqlite rounds half away from zero
+        scale = 10.0 ** places
+        value = pd.Series(value, index=self.ds.index).astype("float64")
+        return np.sign(value) * np.floor(value.abs() * scale + 0.5) / scale
+
+    def fn_date(self, value, *modifiers):
+        return _strftime(_datetime(value, modifiers, self.ds.index), "%Y-%m-%d")
+
+    def fn_time(self, value, *modifiers):
+        return _strftime(_datetime(value, modifiers, self.ds.index), "%H:%M:%S")
+
+    def fn_datetime(self, value, *modifiers):
+        dates = _datetime(value, modifiers, self.ds.index)
+        return _strftime(dates, "%Y-%m-%d %H:%M:%S")
+
+    def fn_julianday(self, value, *modifiers):
+        dates = _datetime(value, modifiers, self.ds.index)
+        return (dates - pd.Timestamp(0)) / pd.Timedelta(days=1) + 2440587.5
+
+    def fn_strftime(self, fmt, value, *modifiers):
+        if not isinstance(fmt, str) or re.search(r"%[^dHjmMSYw%]", fmt):
+            raise UnsupportedExpression("unsupported strftime format")
+        return _strftime(_datetime(value, modifiers, self.ds.index), fmt)
+
+
+def _kind(value):
+    if value is None:
+        return "null"
+    if isinstance(value, str):
+        return "text"
+    if isinstance(value, (bool, int, float, np.number)):
+        return "num"
+    if isinstance(value, pd.Series):
+        if pd.api.types.is_numeric_dtype(value) or isinstance(
+            value.dtype, pd.BooleanDtype
+        ):
+            return "num"
+        inferred = pd.api.types.infer_dtype(value, skipna=True)
+        if inferred in ("string", "empty"):
+            return "text" if inferred == "string" else "null"
+    raise UnsupportedExpression(f"unsupported value {value!r}")
+
+
+def _require(value, kind):
+    if _kind(value) not in (kind, "null"):
+        raise UnsupportedExpression(f"expected a {kind} value")
+
+
+def _isnull(value, index):
+    if isinstance(value, pd.Series):
+        return value.isnull()
+    return pd.Series(value is None, index=index)
+
+
+def _truth(value, index=None):
+    """
+    Converts a value to a nullable boolean, the way sqlite treats
+    values in a boolean context
+    """
+    if isinstance(value, pd.Series) and isinstance(value.dtype, pd.BooleanDtype):
+        return value
+    _require(value, "num")
+    if not isinstance(value, pd.Series):
+        value = pd.Series(value, index=index, dtype="float64")
+    rc = (value != 0).astype("boolean")
+    rc[value.isnull()] = pd.NA
+    return rc
+
+
+def _numeric(value):
+    # booleans in arithmetic are 0 or 1
+    if isinstance(value, pd.Series) and isinstance(value.dtype, pd.BooleanDtype):
+        return value.astype("Int64")
+    return value
+
+
+def _is_integer(value):
+    if isinstance(value, pd.Series):
+        return pd.api.types.is_integer_dtype(value)
+    return isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+
+
+_INT64_MIN = np.iinfo(np.int64).min
+
+
+def _floats(value):
+    if isinstance(value, pd.Series):
+        return value.to_numpy(dtype="float64", na_value=np.nan)
+    return np.float64(value)
+
+
+def _check_overflow(op, left, right):
+    """
+    sqlite switches to real numbers when integer arithmetic overflows,
+    where numpy would silently wrap around
+    """
+    left = np.abs(_floats(left))
+    right = np.abs(_floats(right))
+    bound = left * right if op == "*" else left + right
+    # leave headroom for the rounding of values above 2**53
+    if np.any(bound >= 2.0**62):
+        raise UnsupportedExpression(f"integer {op} may overflow")
+
+
+def _int_divide(left, right):
+    """
+    Integer division truncating towards zero, as sqlite does
+    """
+    if np.any((np.asarray(left) == _INT64_MIN) & (np.asarray(right) == -1)):
+        raise UnsupportedExpression("integer / overflows")
+    remainder = np.fmod(left, right)
+    # left - remainder is an exact multiple of right
+    return (left - remainder) // right
+
+
+def _arithmetic(op, left, right):
+    _require(left, "num")
+    _require(right, "num")
+    if left is None or right is None:
+        return None
+
+    left = _numeric(left)
+    right = _numeric(right)
+    # decided before the zeros are masked out below, which may change dtypes
+    integer = _is_integer(left) and _is_integer(right)
+
+    if op in ("+", "-", "*"):
+        if integer:
+            _check_overflow(op, left, right)
+        if op == "+":
+            return left + right
+        if op == "-":
+            return left - right
+        return left * right
+
+    if op == "%" and not integer:
+        raise UnsupportedExpression("% with real operands")
+
+    # sqlite returns null when dividing by zero
+    zero = None
+    if isinstance(right, pd.Series):
+        zero = (right == 0).fillna(False).astype(bool)
+        right = right.where(~zero, 1)
+    elif right == 0:
+        return None
+
+    if op == "%":
+        rc = np.fmod(left, right)
+    elif integer:
+        rc = _int_divide(left, right)
+    else:
+        rc = left / right
+
+    if zero is not None and zero.any():
+        rc = rc.where(~zero)
+    return rc
+
+
+def _text(value, index):
+    """
+    Returns value as a text Series, converting integers the way sqlite does
+    """
+    kind = _kind(value)
+    if not isinstance(value, pd.Series):
+        value = pd.Series(value, index=index, dtype="object")
+    if kind == "num":
+        if not _is_integer(value):
+            # sqlite's formatting of real numbers differs from python's
+            raise UnsupportedExpression("text conversion of real values")
+        notnull = value.notnull()
+        text = pd.Series(None, index=value.index, dtype="object")
+        text[notnull] = value[notnull].astype("int64").astype(str)
+        value = text
+    return value
+
+
+def _concat(left, right):
+    if left is None or right is None:
+        return None
+    index = left.index if isinstance(left, pd.Series) else right.index
+    if not isinstance(left, pd.Series) and not isinstance(right, pd.Series):
+        return str(left) + str(right)
+    left = _text(left, index)
+    right = _text(right, index)
+    null = left.isnull() | right.isnull()
+    rc = left.fillna("") + right.fillna("")
+    return rc.where(~null, None)
+
+
+_COMPARE = {
+    "=": "eq",
+    "==": "eq",
+    "!=": "ne",
+    "<>": "ne",
+    "<": "lt",
+    "<=": "le",
+    ">": "gt",
+    ">=": "ge",
+}
+
+
+def _compare(op, left, right, index):
+    kinds = {_kind(left), _kind(right)}
+    if left is None or right is None:
+        return pd.Series(pd.NA, index=index, dtype="boolean")
+    if len(kinds) > 1:
+        # sqlite's type affinity rules decide these comparisons
+        raise UnsupportedExpression("comparison between different types")
+
+    if not isinstance(left, pd.Series):
+        left, right = right, left
+        op = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+    if not isinstance(left, pd.Series):
+        left = pd.Series(left, index=index)
+
+    null = left.isnull() | _isnull(right, index)
+    fill = "" if "text" in kinds else 0
+    if isinstance(right, pd.Series):
+        right = right.where(~null, fill)
+    rc = getattr(left.where(~null, fill), _COMPARE[op])(right).astype("boolean")
+    rc[null] = pd.NA
+    return rc
+
+
+def _array(value, index, kinds):
+    if isinstance(value, pd.Series):
+        if isinstance(value.dtype, pd.BooleanDtype):
+            value = value.astype("Int64")
+        if kinds == {"num"}:
+            return value.to_numpy(dtype="float64", na_value=np.nan)
+        return value.to_numpy(dtype="object")
+    if value is None:
+        return np.nan if kinds in ({"num"}, set()) else None
+    return value
+
+
+_ISO_DATE = r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?"
+
+_MODIFIER = re.compile(
+    r"^\s*([-+]?\d+(?:\.\d+)?)\s+(day|hour|minute|second|month|year)s?\s*$", re.I
+)
+
+
+def _datetime(value, modifiers, index):
+    if isinstance(value, str) and value.lower() == "now":
+        raise UnsupportedExpression("'now' is not deterministic")
+    _require(value, "text")
+    if not isinstance(value, pd.Series):
+        value = pd.Series(value, index=index, dtype="object")
+
+    # sqlite only understands ISO-8601 style dates
+    valid = value.str.fullmatch(_ISO_DATE).fillna(False).astype(bool)
+    dates = pd.to_datetime(value.where(valid), format="ISO8601", errors="coerce")
+
+    for modifier in modifiers:
+        if not isinstance(modifier, str):
+            raise UnsupportedExpression("date modifiers must be literals")
+        m = _MODIFIER.match(modifier)
+        lowered = modifier.strip().lower()
+        if lowered == "start of day":
+            dates = dates.dt.normalize()
+        elif lowered == "start of month":
+            dates = dates.dt.normalize() - pd.to_timedelta(dates.dt.day - 1, unit="D")
+        elif lowered == "start of year":
+            dates = dates.dt.normalize() - pd.to_timedelta(
+                dates.dt.dayofyear - 1, unit="D"
+            )
+        elif m:
+            amount = float(m.group(1))
+            unit = m.group(2).lower()
+            if unit in ("month", "year"):
+                if not amount.is_integer() or (dates.dt.day > 28).any():
+                    # sqlite normalizes overflowing days differently than pandas
+                    raise UnsupportedExpression("month arithmetic near month end")
+                months = int(amount) * (12 if unit == "year" else 1)
+                dates = dates + pd.DateOffset(months=months)
+            else:
+                unit = {"day": "D", "hour": "h", "minute": "min", "second": "s"}[unit]
+                dates = dates + pd.Timedelta(amount, unit=unit)
+        else:
+            raise UnsupportedExpression(f"unsupported date modifier {modifier}")
+
+    return dates
+
+
+def _strftime(dates, fmt):
+    rc = dates.dt.strftime(fmt)
+    return rc.where(dates.notnull(), None)
+
+
+def _finalize(value, index):
+    """
+    Converts the result to the types pd.read_sql would return
+    """
+    if not isinstance(value, pd.Series):
+        return pd.Series(value, index=index, dtype=None if value is not None else "object")
+
+    if isinstance(value.dtype, (pd.BooleanDtype, pd.Int64Dtype)):
+        if value.isnull().any():
+            return value.astype("float64")
+        return value.astype("int64")
+    return value
+
+
+def evaluate(ds, query):
+    """
+    Evaluates a sqlite expression against ds and returns the result as a
+    Series. Raises UnsupportedExpression if the expression can't be
+    evaluated with pandas.
+    """
+    tree = parse(query)
+    try:
+        value = _Evaluator(ds).evaluate(tree)
+    except (TypeError, ValueError, AttributeError) as e:
+        raise UnsupportedExpression(str(e)) from e
+    return _finalize(value, ds.index)
@@ -0,0 +1,268 @@
+"""
+Runs pipelines over data which is read in chunks, so datasets larger
+than memory can be processed.
+
+    chunks = read_csv_chunks("events.csv", chunksize=500000)
+    rc = Pipeline().filter(filters).group_by(columns).run_chunks(chunks)
+"""
+
+import pandas as pd
+
+import xforms
+from xforms.pipeline import FusedArithmetic, _ROW_LOCAL
+
+
+# Steps which can be applied to each chunk independently
+STREAMABLE = _ROW_LOCAL | {
+    "filter",
+    "remove_columns",
+    "rename_columns",
+    "reorder_columns",
+    "total_column_sum_new",
+    "combine_columns",
+    "format",
+}
+
+# Number of partial aggregates to keep before combining them
+MAX_PARTIALS = 16
+
+
+def read_csv_chunks(path, chunksize=100000, **kwargs):
+    """
+    Reads a CSV file as a sequence of DataFrames of up to chunksize rows
+    """
+    return pd.read_csv(path, chunksize=chunksize, **kwargs)
+
+
+def read_parquet_chunks(path, columns=None):
+    """
+    Reads a parquet file one row group at a time. Requires pyarrow.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Reading parquet in chunks requires pyarrow")
+
+    f = pq.ParquetFile(path)
+    for i in range(f.num_row_groups):
+        yield f.read_row_group(i, columns=columns).to_pandas()
+
+
+class GroupByAccumulator:
+    """
+    Computes group_by() over data added in chunks. Each chunk is reduced
+    to partial aggregates which are combined at the end. MEDIAN can't be
+    computed from partial results, so its values are kept until the end.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.partials = []
+        self.ordered = None
+
+    def _partial(self, chunk):
+        keys = [c for c in chunk.columns if c not in self.columns]
+        rc = {}
+        for name, action in self.columns.items():
+            if name not in chunk.columns:
+                continue
+            data = chunk[keys + [name]]
+
+            if action == "AVG":
+                rc[name] = (
+                    xforms.group_by(data, {name: "SUM"}),
+                    xforms.group_by(data, {name: "COUNT"}),
+                )
+            elif action == "COUNT_DISTINCT":
+                rc[name] = data.drop_duplicates()
+            elif action == "MEDIAN":
+                rc[name] = data
+            else:
+                rc[name] = xforms.group_by(data, {name: action})
+        return keys, rc
+
+    def _combine(self, partials):
+        keys = partials[0][0]
+        rc = {}
+        for name, action in self.columns.items():
+            parts = [p[name] for _, p in partials if name in p]
+            if not parts:
+                continue
+
+            if action == "AVG":
+                rc[name] = (
+                    _reaggregate([p[0] for p in parts], "SUM"),
+                    _reaggregate([p[1] for p in parts], "SUM"),
+                )
+            elif action in ("COUNT_DISTINCT", "MEDIAN"):
+                rc[name] = pd.concat(parts, ignore_index=True)
+                if action == "COUNT_DISTINCT":
+                    rc[name] = rc[name].drop_duplicates()
+            else:
+                combine = {"COUNT": "SUM"}.get(action, action)
+                rc[name] = _reaggregate(parts, combine)
+        return keys, rc
+
+    def add(self, chunk):
+        if self.ordered is None:
+            self.ordered = list(chunk.columns)
+        self.partials.append(self._partial(chunk))
+        if len(self.partials) > MAX_PARTIALS:
+            self.partials = [self._combine(self.partials)]
+        return self
+
+    def compact(self):
+        """
+        Combines the partial aggregates into one
+        """
+        if len(self.partials) > 1:
+            self.partials = [self._combine(self.partials)]
+        return self
+
+    def merge(self, other):
+        if self.ordered is None:
+            self.ordered = other.ordered
+        self.partials.extend(other.partials)
+        return self
+
+    def result(self):
+        if not self.partials:
+            return pd.DataFrame()
+
+        keys, partial = self._combine(self.partials)
+        rc = {}
+        grouped = None
+        for name, action in self.columns.items():
+            if name not in partial:
+                continue
+            data = partial[name]
+
+            if action == "AVG":
+                sums, counts = data
+                agg = sums.iloc[:, -1] / counts.iloc[:, -1]
+                data = sums
+            elif action in ("COUNT_DISTINCT", "MEDIAN"):
+                data = xforms.group_by(data, {name: action})
+                agg = data.iloc[:, -1]
+            else:
+                agg = data.iloc[:, -1]
+
+            if grouped is None:
+                grouped = data[keys].reset_index(drop=True)
+            label = (
+                f"COUNT(DISTINCT {name})"
+                if action == "COUNT_DISTINCT"
+                else f"{action}({name})"
+            )
+            rc[name] = (label, agg.reset_index(drop=True))
+
+        if grouped is None:
+            return pd.DataFrame()
+
+        out = {}
+        for col in self.ordered:
+            if col in rc:
+                label, values = rc[col]
+                out[label] = values
+            elif col in keys:
+                out[col] = grouped[col]
+        return pd.DataFrame(out)
+
+
+def _reaggregate(parts, action):
+    """
+    Combines partial group_by() results, keeping the name of the
+    aggregated column
+    """
+    data = pd.concat(parts, ignore_index=True)
+    col = data.columns[-1]
+    rc = xforms.group_by(data, {col: action})
+    return rc.rename(columns={rc.columns[-1]: col})
+
+
+def _arguments(step, names):
+    """
+    Returns the step's arguments by position, whether they were
+    passed positionally or by name
+    """
+    return list(step.args) + [step.kwargs[n] for n in names[len(step.args) :]]
+
+
+def _split(steps):
+    """
+    Splits a plan into the steps run on each chunk, the blocking step
+    (if any) and the steps run on its result
+    """
+    for i, step in enumerate(steps):
+        if step.name in ("group_by", "histogram_buckets"):
+            return steps[:i], step, steps[i + 1 :]
+        if step.name != "running_total_new" and not (
+            isinstance(step, FusedArithmetic) or step.name in STREAMABLE
+        ):
+            raise Exception(f"{step.name} can't be run on chunks")
+    return steps, None, []
+
+
+def stream(steps, chunks):
+    """
+    Applies streamable steps to each chunk, yielding the results
+    """
+    carry = {}
+    for chunk in chunks:
+        for i, step in enumerate(steps):
+            if isinstance(step, FusedArithmetic):
+                chunk = step.run(chunk)
+            elif step.name == "running_total_new":
+                # continue the running total from the previous chunk
+                new_col, source = _arguments(step, ["new_col", "source"])
+                values = xforms._widen(chunk[source])
+                total = values.cumsum()
+                if i in carry:
+                    total = total + carry[i]
+                    carry[i] = carry[i] + values.sum()
+                else:
+                    carry[i] = values.sum()
+                chunk[new_col] = total
+            else:
+                fn = getattr(xforms, step.name)
+                chunk = fn(chunk, *step.args, **step.kwargs)
+        yield chunk
+
+
+def run_chunks(steps, chunks):
+    """
+    Runs the steps over the chunks. A group_by or histogram_buckets step is
+    accumulated across chunks and any later steps are run on its result.
+    Without one, the processed chunks are concatenated.
+    """
+    streamed, blocking, rest = _split(steps)
+    chunks = stream(streamed, chunks)
+
+    if blocking is None:
+        rc = pd.concat(list(chunks), ignore_index=True)
+    elif blocking.name == "group_by":
+        (columns,) = _arguments(blocking, ["columns"])
+        acc = GroupByAccumulator(columns)
+        for chunk in chunks:
+            acc.add(chunk)
+        rc = acc.result()
+    else:
+        col, aggregation, bucket_type, custom_buckets = _arguments(
+            blocking, ["col", "aggregation", "bucket_type", "custom_buckets"]
+        )
+        if aggregation != "COUNT":
+            raise Exception("We only support COUNT aggregations in histograms")
+        if bucket_type != "custom_buckets":
+            raise Exception("We only support custom_buckets in histograms")
+
+        acc = xforms.HistogramAccumulator(custom_buckets)
+        for chunk in chunks:
+            acc.add(chunk[col])
+        rc = acc.result()
+
+    for step in rest:
+        if isinstance(step, FusedArithmetic):
+            rc = step.run(rc)
+        else:
+            rc = getattr(xforms, step.name)(rc, *step.args, **step.kwargs)
+    return rc